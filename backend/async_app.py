@@ -0,0 +1,250 @@
+# Async serving mode: /scan and /generate_recipe served by Starlette on one event
+# loop, with OpenFoodFacts, Ollama and Bing called through httpx keep-alive pools
+# (one per upstream) and barcode decoding on main's decode pool. Every other route
+# is the Flask app, mounted underneath. Responses are the same JSON as main.py.
+# Run from the repository root:
+#   uvicorn async_app:app --app-dir backend --port 8000
+#   python backend/async_app.py
+import asyncio
+import functools
+import os
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import main
+import metrics
+from llm import OLLAMA_URL, generate_request, parse_generate_response
+from thumbnails import HEADERS, image_search_url, parse_first_image_url
+
+# Connections kept open per upstream, requests beyond that wait for a free one
+OPENFOODFACTS_CONNECTIONS = int(os.environ.get('OPENFOODFACTS_CONNECTIONS', 16))
+OLLAMA_CONNECTIONS = int(os.environ.get('OLLAMA_CONNECTIONS', 2))
+BING_CONNECTIONS = int(os.environ.get('BING_CONNECTIONS', 4))
+
+def upstream_client(connections, timeout, **kwargs):
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections,
+                            keepalive_expiry=60),
+        # Waiting for a pooled connection isn't an upstream failure, only the request itself is timed
+        timeout=httpx.Timeout(timeout, pool=None),
+        **kwargs
+    )
+
+clients = {}
+
+@asynccontextmanager
+async def lifespan(app):
+    main.init_db()
+    main.start_background_jobs()
+    clients['openfoodfacts'] = upstream_client(OPENFOODFACTS_CONNECTIONS, 5)
+    clients['ollama'] = upstream_client(OLLAMA_CONNECTIONS, 60)
+    clients['bing'] = upstream_client(BING_CONNECTIONS, 5, headers=HEADERS)
+    try:
+        yield
+    finally:
+        for client in clients.values():
+            await client.aclose()
+        clients.clear()
+
+async def fetch_product_info(barcode):
+    # Raises when OpenFoodFacts can't be reached, returns None when the product doesn't exist
+    response = await clients['openfoodfacts'].get(f"{main.OPENFOODFACTS_URL}/api/v0/product/{barcode}.json")
+    response.raise_for_status()
+    return main.parse_product_response(barcode, response.json())
+
+async def get_product_info(barcode):
+    try:
+        with metrics.span('product_lookup'):
+            product_info = await asyncio.get_running_loop().run_in_executor(None, main.local_products.lookup, barcode)
+            if product_info:
+                metrics.tag('local')
+                return product_info
+            return await main.product_cache.get_async(barcode, fetch_product_info)
+    except Exception as e:
+        print(f"Error fetching product info: {str(e)}")
+        return None
+
+async def process_instructions_with_qwen(raw_instructions, recipe_title):
+    response = await clients['ollama'].post(f"{OLLAMA_URL}/api/generate",
+                                            json=generate_request(raw_instructions, recipe_title))
+    response.raise_for_status()
+    return parse_generate_response(response.json(), response.text)
+
+async def get_first_image_url(query):
+    response = await clients['bing'].get(image_search_url(query))
+    response.raise_for_status()
+    return await asyncio.get_running_loop().run_in_executor(None, parse_first_image_url, response.content)
+
+async def resolve_image_url(match):
+    with metrics.span('image_lookup'):
+        return await main.thumbnail_store.resolve_async(match['recipe_id'], match['title'], get_first_image_url)
+
+def timed(handler):
+    # Same request timings and Server-Timing header as the Flask routes get
+    @functools.wraps(handler)
+    async def wrapper(request):
+        started = time.perf_counter()
+        metrics.start_request()
+        response = await handler(request)
+        timing = metrics.finish_request(request.url.path, response.status_code, time.perf_counter() - started)
+        if main.SERVER_TIMING:
+            response.headers['Server-Timing'] = timing
+        return response
+    return wrapper
+
+@timed
+async def scan_and_process(request):
+    form = await request.form()
+    images = form.getlist('images')
+    if not images:
+        return JSONResponse({"error": "No image files provided"}, status_code=400)
+
+    session_id = form.get('session_id')
+    if not session_id:
+        return JSONResponse({"error": "No session ID provided"}, status_code=400)
+
+    background = form.get('background') == '1' and main.job_queue.running
+    loop = asyncio.get_running_loop()
+
+    # Per-file outcomes, reported in upload order whatever order the stages finish in
+    results = [[] for _ in images]
+    decodes = {}
+    for i, image in enumerate(images):
+        # A file input left empty arrives as a plain field
+        if isinstance(image, str) or not image.filename:
+            results[i].append({"file": "No file selected", "error": "Empty filename"})
+            continue
+        with metrics.span('upload_read'):
+            image_data = await image.read()
+        decodes[loop.run_in_executor(main.decode_pool, metrics.bind(main.decode_image), image_data, session_id)] = i
+
+    # Stage 1: decode on the decode pool, stage 2 starts lookups as soon as an image is decoded
+    lookups = {}
+    barcodes = {}
+    pending = set(decodes)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            i = decodes[future]
+            image_barcodes, message = future.result()
+            if not image_barcodes:
+                results[i].append({"file": images[i].filename, "error": message})
+                continue
+            # A photo may hold several products
+            barcodes[i] = image_barcodes
+            if background:
+                continue
+            for barcode_data in image_barcodes:
+                # Same product photographed twice is only looked up once
+                if barcode_data not in lookups:
+                    lookups[barcode_data] = asyncio.ensure_future(get_product_info(barcode_data))
+
+    if background and barcodes:
+        errors = [result for file_results in results for result in file_results]
+        body = await loop.run_in_executor(None, main.queue_scan, session_id,
+                                          [(images[i].filename, barcodes[i]) for i in sorted(barcodes)], errors)
+        return JSONResponse(body, status_code=202)
+
+    found = []
+    for i in sorted(barcodes):
+        for barcode_data in barcodes[i]:
+            try:
+                product_info = await lookups[barcode_data]
+            except Exception as e:
+                results[i].append({"file": images[i].filename, "error": f"Error processing image: {str(e)}"})
+                continue
+            if not product_info:
+                results[i].append({"file": images[i].filename, "error": "Product not found in database"})
+                continue
+            results[i].append(dict(product_info))
+            found.append((i, len(results[i]) - 1))
+
+    # Stage 3: one transaction for the whole upload, off the event loop
+    if found:
+        try:
+            await loop.run_in_executor(None, metrics.bind(main.save_products_to_db),
+                                       [results[i][j] for i, j in found], session_id)
+        except Exception as e:
+            for i, j in found:
+                results[i][j] = {"file": images[i].filename, "error": f"Error processing image: {str(e)}"}
+
+    products = [result for file_results in results for result in file_results if "error" not in result]
+    errors = [result for file_results in results for result in file_results if "error" in result]
+
+    if not products and not errors:
+        return JSONResponse({"error": "No valid products processed"}, status_code=400)
+
+    return JSONResponse({
+        "message": "Processed images",
+        "products": products,
+        "errors": errors
+    })
+
+@timed
+async def generate_recipe(request):
+    data = await request.json()
+    session_id = data.get('session_id')
+
+    if not session_id:
+        return JSONResponse({"error": "No session ID provided"}, status_code=400)
+
+    loop = asyncio.get_running_loop()
+
+    # First pass: rank candidate recipes without processing instructions, only the page is kept
+    try:
+        matches, runners_up, next_cursor = await loop.run_in_executor(None, metrics.bind(main.rank_page),
+                                                                      session_id, data)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    # Format the runners-up in the background so they are cached if asked for later
+    main.instruction_formatter.prefetch(runners_up)
+
+    # Second pass: instructions and thumbnails for the page, all fetched concurrently
+    recipes = await loop.run_in_executor(None, metrics.bind(main.get_recipes), [match['recipe_id'] for match in matches])
+    async def format_instructions():
+        with metrics.span('llm'):
+            return await main.instruction_formatter.format_many_async([
+                (match['recipe_id'], match['title'], recipes.get(match['recipe_id'], (None, None))[1])
+                for match in matches
+            ], process_instructions_with_qwen)
+
+    formatted, image_urls = await asyncio.gather(
+        format_instructions(),
+        asyncio.gather(*(resolve_image_url(match) for match in matches))
+    )
+    for match, instructions, image_url in zip(matches, formatted, image_urls):
+        match['instructions'] = instructions
+        if image_url:
+            match['imageURL'] = image_url
+
+    # Only queued here, the match log writes in the background
+    log_file = main.log_matches(session_id, matches)
+
+    print(f"Logged {len(matches)} matches at {log_file}")
+    return JSONResponse({
+        "matches": matches,
+        "log_file": log_file,
+        "next_cursor": next_cursor
+    })
+
+app = Starlette(
+    routes=[
+        Route('/scan', scan_and_process, methods=['POST']),
+        Route('/generate_recipe', generate_recipe, methods=['POST']),
+        # /generate_recipe/stream, /cache_stats, ... stay on Flask, run on threads
+        Mount('/', app=WsgiToAsgi(main.app)),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, port=8000)
@@ -0,0 +1,96 @@
+# Concurrent scan + generate database throughput, connection per call vs pooled.
+# The products database and its statements are main's own, as /scan and
+# /generate_recipe run them.
+#   python backend/bench_db.py --threads 16 --seconds 5
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import main
+from db import ConnectionPool
+
+def make_databases(directory, recipes=2000):
+    products_path = os.path.join(directory, 'products.db')
+    recipes_path = os.path.join(directory, 'recipes.db')
+
+    conn = sqlite3.connect(products_path)
+    main.create_products_table(conn)
+    conn.close()
+
+    conn = sqlite3.connect(recipes_path)
+    conn.execute('CREATE TABLE recipes (id INTEGER PRIMARY KEY, Title TEXT, Ingredients TEXT, Instructions TEXT)')
+    conn.executemany(
+        'INSERT INTO recipes (Title, Ingredients, Instructions) VALUES (?, ?, ?)',
+        [(f"Recipe {i}", "milk, sugar, cocoa", "Mix everything. " * 40) for i in range(recipes)]
+    )
+    conn.commit()
+    conn.close()
+    return products_path, recipes_path
+
+def scan_and_generate(products, recipes, session_id, recipe_count):
+    """DB work of one /scan with six images followed by one /generate_recipe."""
+    rows = main.product_rows([{"barcode": f"5449000000{i:03d}", "product_name": "Coca-Cola",
+                               "category": "Beverages, Sodas"} for i in range(6)], session_id)
+    with products() as conn:
+        main.write_products(conn, rows, session_id)
+    with products() as conn:
+        main.session_version(conn, session_id)
+        main.read_session_products(conn, session_id)
+    recipe_ids = random.sample(range(1, recipe_count + 1), 2)
+    with recipes() as conn:
+        conn.execute('SELECT id, Instructions FROM recipes WHERE id IN (?, ?)', recipe_ids).fetchall()
+
+def connect_per_call(path, row_factory=None):
+    class Connection:
+        def __enter__(self):
+            self.conn = sqlite3.connect(path)
+            self.conn.row_factory = row_factory
+            return self.conn
+
+        def __exit__(self, *exc):
+            self.conn.close()
+    return Connection
+
+def run(products, recipes, threads, seconds, recipe_count):
+    done = [0] * threads
+    deadline = time.time() + seconds
+
+    def worker(n):
+        while time.time() < deadline:
+            scan_and_generate(products, recipes, f"session-{n}-{done[n] % 50}", recipe_count)
+            done[n] += 1
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return sum(done) / seconds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark scan + generate database throughput")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--recipes', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as before_dir, tempfile.TemporaryDirectory() as after_dir:
+        products_path, recipes_path = make_databases(before_dir, args.recipes)
+        before = run(connect_per_call(products_path, sqlite3.Row), connect_per_call(recipes_path),
+                     args.threads, args.seconds, args.recipes)
+
+        products_path, recipes_path = make_databases(after_dir, args.recipes)
+        products_db = ConnectionPool(products_path, size=args.threads, row_factory=sqlite3.Row)
+        recipes_db = ConnectionPool(recipes_path, read_only=True, size=args.threads)
+        after = run(products_db.connection, recipes_db.connection,
+                    args.threads, args.seconds, args.recipes)
+        products_db.close_all()
+        recipes_db.close_all()
+
+    print(f"{args.threads} threads, scan+generate round trips per second")
+    print(f"  connection per call: {before:8.1f}")
+    print(f"  pooled + WAL:        {after:8.1f}  ({after / before:.2f}x)")
@@ -0,0 +1,166 @@
+# Microbenchmarks for the hot paths: barcode decoding (scan_barcode), the
+# ingredient matcher (check_product_matches_ingredient) and recipe ranking with
+# every scoring engine, on the real recipe table or a synthetic one.
+#   python backend/gen_recipes.py --recipes 100000 --out /tmp/bench/recipes.db
+#   python backend/bench_micro.py --recipes-db /tmp/bench/recipes.db
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from ingredients import check_product_matches_ingredient, split_ingredients
+from loadtest import load_images, percentile
+from ranking import RankingOptions
+from recipe_index import RecipeIndex, RecipeIndexLoader
+from recipe_matrix import RecipeMatrixLoader
+from recipe_snapshot import RecipeSnapshot, write_snapshot
+from scanner import scan_barcode
+from session_state import SessionMatches
+
+# A typical basket: the stand-in OpenFoodFacts products plus some staples
+BENCH_PRODUCTS = [
+    ("Coca-Cola", "Beverages, Carbonated drinks, Sodas, Colas"),
+    ("Nutella", "Breakfasts, Spreads, Sweet spreads, Cocoa and hazelnuts spreads"),
+    ("Ruffles Original", "Snacks, Salty snacks, Crisps, Potato crisps"),
+    ("Fresh Milk", "Dairies, Milks, Fresh milks, Pasteurised milks"),
+    ("Free Range Eggs", "Farming products, Eggs, Chicken eggs"),
+    ("Unsalted Butter", "Dairies, Fats, Butters"),
+    ("Basmati Rice", "Plant-based foods, Cereals and potatoes, Rices"),
+    ("Extra Virgin Olive Oil", "Plant-based foods, Fats, Vegetable oils, Olive oils"),
+    ("Garlic", "Plant-based foods, Vegetables, Garlic"),
+    ("Cheddar", "Dairies, Cheeses, Cheddar"),
+]
+
+def bench_products(count):
+    return [{"barcode": str(i), "name": name, "category": category}
+            for i, (name, category) in enumerate((BENCH_PRODUCTS * (count // len(BENCH_PRODUCTS) + 1))[:count])]
+
+def measure(fn, repeat, setup=None):
+    """Seconds per call of fn(), `repeat` times. setup() runs untimed before each call and its result is passed on."""
+    samples = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def report(name, samples, per=1, unit='ms'):
+    scale = {'ms': 1e3, 'us': 1e6}[unit] / per
+    print(f"{name:<36}{sum(samples) / len(samples) * scale:>12.3f}{percentile(samples, 50) * scale:>12.3f}"
+          f"{percentile(samples, 95) * scale:>12.3f} {unit}")
+
+def rank_by_index(index, products, k):
+    # Same ordering as rank_recipes: highest percentage first, table order among ties
+    counts = index.match_counts(products)
+    scored = [(position, count, round((count / index.total_ingredients[position]) * 100, 2))
+              for position, count in counts.items()]
+    return sorted(scored, key=lambda match: (-match[2], match[0]))[:k]
+
+def rank_brute_force(recipes, products, k):
+    # The full scan /generate_recipe did before the index existed
+    matches = []
+    for position, ingredients in enumerate(recipes):
+        count = sum(1 for ingredient in ingredients
+                    if any(check_product_matches_ingredient(product, ingredient) for product in products))
+        if count:
+            matches.append((position, count, round((count / len(ingredients)) * 100, 2)))
+    return sorted(matches, key=lambda match: (-match[2], match[0]))[:k]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for scanning, matching and ranking")
+    parser.add_argument('--recipes-db', default='backend/recipes.db')
+    parser.add_argument('--images', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'img'))
+    parser.add_argument('--products', type=int, default=6, help="products in the benchmark session")
+    parser.add_argument('--top', type=int, default=10, help="matches asked from the rankers")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--match-mode', choices=['strict', 'fuzzy'], default='strict')
+    parser.add_argument('--brute-force-max', type=int, default=20000,
+                        help="only time the unindexed full scan on tables up to this many recipes")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    products = bench_products(args.products)
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    print(f"{'':<36}{'mean':>12}{'p50':>12}{'p95':>12}")
+
+    # Barcode decoding, every sample image
+    for name, data in load_images(args.images) if os.path.isdir(args.images) else []:
+        report(f"scan_barcode {name}", measure(lambda: scan_barcode(data), max(1, args.repeat // 4)))
+
+    # The matcher on its own, over a sample of real ingredient strings
+    conn = sqlite3.connect(f'file:{args.recipes_db}?mode=ro', uri=True)
+    recipes = [split_ingredients(ingredients) for (ingredients,) in conn.execute('SELECT Ingredients FROM recipes')]
+    conn.close()
+    sample = rng.sample([ingredient for ingredients in recipes[:20000] for ingredient in ingredients], 2000)
+    pairs = [(product, ingredient) for ingredient in sample for product in products]
+    report("check_product_matches_ingredient",
+           measure(lambda: [check_product_matches_ingredient(product, ingredient) for product, ingredient in pairs],
+                   args.repeat), per=len(pairs), unit='us')
+
+    # Index and matrix builds
+    index_loader = RecipeIndexLoader(args.recipes_db, os.path.join(workdir, 'ingredient_forms.db'),
+                                     match_mode=args.match_mode)
+    started = time.perf_counter()
+    index = index_loader.get()
+    report("build recipe index", [time.perf_counter() - started])
+    matrix_loader = RecipeMatrixLoader(index_loader, os.path.join(workdir, 'recipe_matrix.npz'))
+    started = time.perf_counter()
+    _, matrix = matrix_loader.get()
+    report("build recipe matrix", [time.perf_counter() - started])
+    signature = repr(index_loader.signature)
+    started = time.perf_counter()
+    write_snapshot(index, os.path.join(workdir, 'snapshot'), signature)
+    report("export recipe snapshot", [time.perf_counter() - started])
+    started = time.perf_counter()
+    snapshot_index = RecipeIndex.from_snapshot(RecipeSnapshot.open(os.path.join(workdir, 'snapshot'), signature),
+                                               match_mode=args.match_mode)
+    report("open recipe snapshot", [time.perf_counter() - started])
+
+    # Resolving the session's products to matching ingredient forms, every engine's first step
+    report(f"resolve products ({args.match_mode})", measure(lambda: index.session_bases(products), args.repeat),
+           per=len(products))
+
+    # Ranking one session with each engine
+    expected = rank_by_index(index, products, args.top)
+    report(f"rank index ({len(recipes)} recipes)", measure(lambda: rank_by_index(index, products, args.top), args.repeat))
+    report("rank index, snapshot", measure(lambda: rank_by_index(snapshot_index, products, args.top), args.repeat))
+    assert rank_by_index(snapshot_index, products, args.top) == expected
+    # As rank_page does with SCORING_ENGINE=matrix
+    def rank_by_matrix():
+        return matrix.top_matches(matrix.match_counts(index.session_bases(products)), RankingOptions(), args.top)
+
+    report("rank matrix", measure(rank_by_matrix, args.repeat))
+    assert rank_by_matrix() == expected
+
+    def fresh_session():
+        return SessionMatches(index)
+
+    def rank_cold(state):
+        state.add_products(products)
+        return state.ranked()[:args.top]
+
+    report("rank session, rebuilt", measure(rank_cold, args.repeat, fresh_session))
+
+    def session_missing_one():
+        state = SessionMatches(index)
+        state.add_products(products[:-1])
+        return state
+
+    def rank_after_scan(state):
+        state.add_products(products[-1:])
+        return state.ranked()[:args.top]
+
+    report("rank session, one new product", measure(rank_after_scan, args.repeat, session_missing_one))
+    warm = SessionMatches(index)
+    warm.add_products(products)
+    report("rank session, unchanged", measure(lambda: warm.ranked()[:args.top], args.repeat))
+    assert warm.ranked()[:args.top] == expected
+
+    # The full scan is the strict matcher, it has nothing to compare fuzzy rankings with
+    if len(recipes) <= args.brute_force_max and args.match_mode == 'strict':
+        report("rank full scan (no index)", measure(lambda: rank_brute_force(recipes, products, args.top),
+                                                   max(1, args.repeat // 10)))
+        assert rank_brute_force(recipes, products, args.top) == expected
@@ -0,0 +1,58 @@
+# Barcode detection benchmark over the sample images: decode latency and hit
+# rate of every stage on its own, and of the staged engine with early exit.
+#   python backend/bench_scan.py [--dir backend/img] [--repeat 5]
+import argparse
+import os
+import time
+
+from scanner import DETECTION_STAGES, decode_all, detect_barcodes, load_grayscale
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def time_call(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def run_stage(stage, gray):
+    found = []
+    for candidate in stage(gray):
+        for barcode_data, _ in decode_all(candidate):
+            if barcode_data not in found:
+                found.append(barcode_data)
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark barcode detection stages")
+    parser.add_argument('--dir', default=os.path.join(os.path.dirname(__file__), 'img'))
+    parser.add_argument('--repeat', type=int, default=5, help="best of N runs per measurement")
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.dir, name) for name in os.listdir(args.dir)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    stage_names = [name for name, _ in DETECTION_STAGES]
+    hits = {name: 0 for name in stage_names + ['engine']}
+    totals = {name: 0.0 for name in stage_names + ['engine']}
+
+    print(f"{'image':<20}" + ''.join(f"{name:>16}" for name in stage_names) + f"{'engine':>22}")
+    for path in paths:
+        gray = load_grayscale(path)
+        row = f"{os.path.basename(path):<20}"
+        for name, stage in DETECTION_STAGES:
+            found, elapsed = time_call(lambda: run_stage(stage, gray), args.repeat)
+            hits[name] += bool(found)
+            totals[name] += elapsed
+            row += f"{elapsed * 1000:>9.1f}ms {'hit ' if found else 'miss'}"
+        (found, stage_hit), elapsed = time_call(lambda: detect_barcodes(gray), args.repeat)
+        hits['engine'] += bool(found)
+        totals['engine'] += elapsed
+        row += f"{elapsed * 1000:>9.1f}ms {stage_hit or 'miss':<10} {', '.join(found)}"
+        print(row)
+
+    print()
+    for name in stage_names + ['engine']:
+        print(f"{name:<12} hit rate {hits[name]}/{len(paths)}  mean {totals[name] / len(paths) * 1000:.1f}ms")
@@ -0,0 +1,126 @@
+# Most specific food category of an OpenFoodFacts category list ("Beverages,
+# Carbonated drinks, Sodas, Colas" -> "Colas"), using the WordNet noun hierarchy.
+# The corpora only have to be fetched once:
+#   python backend/categories.py --download
+#   python backend/categories.py "Dairies, Milks, Fresh Milks, Pasteurised Milks"
+import threading
+
+try:
+    from nltk.corpus import wordnet as wn
+except ImportError:
+    wn = None
+
+# A category is food when one of its senses sits anywhere under these synsets
+FOOD_ROOTS = ('food.n.01', 'fruit.n.01', 'beverage.n.01', 'dairy_product.n.01',
+              'meat.n.01', 'vegetable.n.01', 'cereal.n.01')
+# Depths are measured below the list's first category, or below this when it isn't a noun
+DEFAULT_ROOT = 'food'
+
+def hyponym_depths(root):
+    """Longest hyponym chain from root to every synset under it, {synset: edges}."""
+    order, seen, stack = [], {root}, [(root, False)]
+    while stack:
+        synset, expanded = stack.pop()
+        if expanded:
+            order.append(synset)
+            continue
+        stack.append((synset, True))
+        for child in synset.hyponyms() + synset.instance_hyponyms():
+            if child not in seen:
+                seen.add(child)
+                stack.append((child, False))
+
+    # Reverse post-order is a topological order of the hyponym DAG
+    depths = dict.fromkeys(order, 0)
+    for synset in reversed(order):
+        for child in synset.hyponyms() + synset.instance_hyponyms():
+            depths[child] = max(depths[child], depths[synset] + 1)
+    return depths
+
+class CategoryClassifier:
+    """
+    Picks the most specific food category out of a product's category string.
+
+    WordNet is loaded once and everything under the food roots is kept in one
+    set, so whether a word is food is a few lookups. For depths, every root
+    (the first category of a list) gets its hyponym depths computed the first
+    time it is seen. Noun senses are memoized per word.
+    """
+
+    def __init__(self, food_roots=FOOD_ROOTS):
+        self.food_roots = food_roots
+        self._lock = threading.Lock()
+        self._food = None  # set of every synset under a food root
+        self._roots = {}  # root word -> (nodes from the top of WordNet to it, hyponym depths) or None
+        self._senses = {}  # word -> noun synsets
+
+    def load(self):
+        """Load WordNet and the food closure. False when nltk or the corpus isn't installed."""
+        if self._food is None:
+            with self._lock:
+                if self._food is None:
+                    food = set()
+                    if wn is None:
+                        print("nltk is not installed, specific categories are not stored")
+                    else:
+                        try:
+                            for name in self.food_roots:
+                                food.update(hyponym_depths(wn.synset(name)))
+                        except LookupError:
+                            print("WordNet corpus not found, run: python backend/categories.py --download")
+                    self._food = food
+        return bool(self._food)
+
+    def senses(self, word):
+        senses = self._senses.get(word)
+        if senses is None:
+            senses = self._senses[word] = tuple(wn.synsets(word, pos=wn.NOUN))
+        return senses
+
+    def root(self, word):
+        if word not in self._roots:
+            try:
+                synset = wn.synset(f'{word}.n.01')
+            except Exception:
+                synset = None
+            if synset is not None:
+                top = max(len(path) for path in synset.hypernym_paths())
+                synset = (top, hyponym_depths(synset))
+            self._roots[word] = synset
+        return self._roots[word]
+
+    def is_food(self, word):
+        return any(synset in self._food for synset in self.senses(word))
+
+    def depth(self, word, root):
+        """Length of the longest hypernym path from a sense of word that passes through root, 0 if none."""
+        top, depths = root
+        return max((top + depths[synset] for synset in self.senses(word) if synset in depths), default=0)
+
+    def most_specific(self, categories):
+        """Deepest food category in a comma separated category string, None when there isn't one."""
+        if not categories or not self.load():
+            return None
+        names = [name.strip() for name in categories.split(',') if name.strip()]
+        food = [name for name in names if self.is_food(name)]
+        if not food:
+            return None
+        root = self.root(names[0].lower()) or self.root(DEFAULT_ROOT)
+        return max(food, key=lambda name: self.depth(name, root))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Most specific food category of category lists")
+    parser.add_argument('categories', nargs='*', help='comma separated category strings')
+    parser.add_argument('--download', action='store_true', help='fetch the WordNet corpora')
+    args = parser.parse_args()
+
+    if args.download:
+        import nltk
+        nltk.download('wordnet')
+        nltk.download('omw-1.4')
+
+    classifier = CategoryClassifier()
+    for categories in args.categories:
+        print(f"{categories} -> {classifier.most_specific(categories)}")
@@ -0,0 +1,118 @@
+from collections import Counter, defaultdict
+
+# Words shorter than this only match after stemming, never by similarity
+MIN_FUZZY_LENGTH = 4
+# Short food words one letter apart are usually different foods (beer / beef, mild / milk),
+# below this length a word needs its exact stem
+MIN_EDIT_LENGTH = 6
+
+# Pairs that must never match, checked by running this module
+FALSE_FRIENDS = [
+    ("beer", "beef"), ("wine", "wing"), ("wine", "wings"), ("pear", "peas"), ("mild", "milk"),
+    ("beet", "beef"), ("bear", "beans"), ("cork", "corn"), ("breakfasts", "breast"),
+]
+# Pairs that must match
+NEAR_SPELLINGS = [
+    ("hazelnuts", "hazelnut"), ("choclate", "chocolate"), ("tomatoes", "tomato"), ("berries", "berry"),
+    ("yoghurt", "yogurt"), ("bananna", "banana"),
+]
+
+def stem(word):
+    """Light English plural stemmer: berries -> berry, potatoes -> potato, peaches -> peach, eggs -> egg."""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('oes', 'ches', 'shes', 'sses', 'xes', 'zes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def max_edits(word):
+    if len(word) < MIN_EDIT_LENGTH:
+        return 0
+    return 1 if len(word) < 8 else 2
+
+def edit_distance(a, b):
+    """Levenshtein distance counting an adjacent transposition as one edit."""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        previous, before, current = current, previous, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+class FuzzyMatcher:
+    """
+    Fuzzy counterpart of the strict word match in check_product_matches_ingredient.
+
+    Every word of the ingredient vocabulary is stemmed, and the stems are indexed by
+    their trigrams. A product word then matches the ingredients holding the same stem,
+    or any stem whose trigram similarity (Dice coefficient) reaches the threshold and
+    that is at most one edit away (none for words under 6 letters, two for words of 8
+    letters or more). The Dice score favours shared beginnings, so a different last
+    letter alone never counts as a near spelling. That catches plurals ("hazelnuts" /
+    "hazelnut") and typos ("choclate") without comparing the word with the whole
+    vocabulary: only stems sharing a trigram with it are scored, and only those above
+    the threshold get the edit distance check. FALSE_FRIENDS lists pairs it must keep
+    apart, run this module to check them.
+    """
+
+    def __init__(self, token_bases, threshold=0.6):
+        """token_bases: ingredient word -> base forms containing it, as in RecipeIndex."""
+        self.threshold = threshold
+        stem_bases = defaultdict(set)
+        for word, bases in token_bases.items():
+            stem_bases[stem(word)].update(bases)
+        self.stem_bases = dict(stem_bases)
+
+        self.stems = list(self.stem_bases)
+        self.stem_trigrams = [len(trigrams(word)) for word in self.stems]
+        postings = defaultdict(list)
+        for position, word in enumerate(self.stems):
+            for trigram in trigrams(word):
+                postings[trigram].append(position)
+        self.postings = dict(postings)
+
+    def similar_stems(self, word):
+        """Stems of the vocabulary at least `threshold` similar to the stemmed word, with their score."""
+        word = stem(word)
+        if len(word) < MIN_FUZZY_LENGTH:
+            return [(word, 1.0)] if word in self.stem_bases else []
+        query = trigrams(word)
+        shared = Counter()
+        for trigram in query:
+            shared.update(self.postings.get(trigram, ()))
+        matches = []
+        for position, count in shared.items():
+            score = 2 * count / (len(query) + self.stem_trigrams[position])
+            if score >= self.threshold:
+                similar = self.stems[position]
+                if similar != word and len(similar) == len(word) and similar[:-1] == word[:-1]:
+                    continue
+                if edit_distance(word, similar) <= max_edits(min(word, similar, key=len)):
+                    matches.append((similar, score))
+        return matches
+
+    def matching_bases(self, product_words):
+        matched = set()
+        for word in product_words:
+            if len(word) > 2:
+                for similar, _ in self.similar_stems(word):
+                    matched |= self.stem_bases[similar]
+        return matched
+
+if __name__ == "__main__":
+    words = {word for pair in FALSE_FRIENDS + NEAR_SPELLINGS for word in pair}
+    matcher = FuzzyMatcher({word: {word} for word in words})
+    failed = [(word, other) for word, other in FALSE_FRIENDS if other in matcher.matching_bases([word])]
+    failed += [(word, other) for word, other in NEAR_SPELLINGS if other not in matcher.matching_bases([word])]
+    for word, other in failed:
+        print(f"Wrong answer for {word} / {other}")
+    print(f"{len(FALSE_FRIENDS) + len(NEAR_SPELLINGS) - len(failed)} of {len(FALSE_FRIENDS) + len(NEAR_SPELLINGS)} pairs ok")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,90 @@
+# Synthetic recipes.db for benchmarks, shaped like the real table (ingredient lists
+# stored as Python list text, prose instructions) but of any size and reproducible.
+#   python backend/gen_recipes.py --recipes 100000 --out /tmp/bench/recipes.db
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+BASE_INGREDIENTS = [
+    'milk', 'butter', 'cream', 'yogurt', 'cheddar cheese', 'parmesan', 'mozzarella', 'eggs',
+    'flour', 'sugar', 'brown sugar', 'salt', 'black pepper', 'baking powder', 'baking soda',
+    'olive oil', 'vegetable oil', 'sesame oil', 'soy sauce', 'fish sauce', 'vinegar', 'honey',
+    'maple syrup', 'garlic', 'onion', 'shallot', 'ginger', 'scallions', 'tomatoes', 'potatoes',
+    'carrots', 'celery', 'bell pepper', 'jalapeno', 'spinach', 'kale', 'lettuce', 'cabbage',
+    'broccoli', 'cauliflower', 'zucchini', 'eggplant', 'mushrooms', 'corn', 'peas', 'green beans',
+    'chickpeas', 'black beans', 'lentils', 'rice', 'pasta', 'noodles', 'bread', 'breadcrumbs',
+    'oats', 'quinoa', 'chicken breast', 'chicken thighs', 'beef', 'pork', 'bacon', 'sausage',
+    'ham', 'turkey', 'lamb', 'salmon', 'tuna', 'shrimp', 'cod', 'anchovies', 'lemon', 'lime',
+    'orange', 'apple', 'banana', 'strawberries', 'blueberries', 'raspberries', 'peaches',
+    'pineapple', 'mango', 'coconut milk', 'almonds', 'walnuts', 'pecans', 'hazelnuts',
+    'peanut butter', 'chocolate', 'cocoa powder', 'vanilla extract', 'cinnamon', 'nutmeg',
+    'cumin', 'paprika', 'chili powder', 'oregano', 'basil', 'thyme', 'rosemary', 'parsley',
+    'cilantro', 'mint', 'dill', 'bay leaves', 'mustard', 'mayonnaise', 'ketchup', 'tea',
+    'coffee', 'white wine', 'red wine', 'beer', 'chicken stock', 'vegetable stock', 'cola',
+]
+# Extra words so the vocabulary grows with the table, like the real data set does
+VARIETIES = ['', '', '', '', 'red', 'yellow', 'baby', 'italian', 'greek', 'japanese', 'mexican',
+             'wholegrain', 'heirloom', 'smoked', 'spiced', 'toasted', 'french', 'thai']
+PREPARATIONS = ['', '', '', 'fresh', 'chopped', 'minced', 'sliced', 'diced', 'ground', 'grated',
+                'organic', 'frozen', 'dried', 'unsalted', 'extra-virgin', 'crushed', 'peeled']
+QUANTITIES = ['', '1', '2', '3', '1/2', '1/4', '3/4', '1 1/2', '4', '6', '8']
+UNITS = ['', 'cup', 'cups', 'tsp.', 'Tbsp.', 'oz.', 'lb.', 'g', 'ml', 'large', 'small', 'pinch of']
+STEPS = [
+    'Preheat the oven to {temp} degrees.', 'Whisk the {a} and {b} together in a large bowl.',
+    'Heat the {a} in a skillet over medium heat.', 'Add the {b} and cook until soft, about {mins} minutes.',
+    'Stir in the {a} and season to taste.', 'Bring to a boil, then reduce heat and simmer for {mins} minutes.',
+    'Fold in the {b} gently.', 'Transfer to a baking dish and bake until golden, {mins} to {more} minutes.',
+    'Let rest for {mins} minutes before serving.', 'Garnish with {a} and serve warm.',
+]
+
+def ingredient_line(rng):
+    name = ' '.join(part for part in (rng.choice(PREPARATIONS), rng.choice(VARIETIES), rng.choice(BASE_INGREDIENTS)) if part)
+    amount = ' '.join(part for part in (rng.choice(QUANTITIES), rng.choice(UNITS)) if part)
+    return f"{amount} {name}" if amount else name
+
+def make_recipe(rng, number):
+    ingredients = [ingredient_line(rng) for _ in range(rng.randint(4, 16))]
+    names = [line.split()[-1] for line in ingredients]
+    steps = ' '.join(
+        rng.choice(STEPS).format(a=rng.choice(names), b=rng.choice(names), temp=rng.choice((350, 375, 400, 425)),
+                                 mins=rng.randint(2, 20), more=rng.randint(21, 45))
+        for _ in range(rng.randint(3, 8))
+    )
+    title = f"{rng.choice(VARIETIES).title()} {names[0].title()} with {names[1].title()} #{number}".strip()
+    return title, repr(ingredients), steps, f"recipe-{number}"
+
+def generate(path, recipes, seed=0, batch_size=10000):
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE recipes (
+            id INTEGER PRIMARY KEY,
+            Title TEXT,
+            Ingredients TEXT,
+            Instructions TEXT,
+            Image_Name TEXT
+        )
+    ''')
+    for start in range(0, recipes, batch_size):
+        conn.executemany(
+            'INSERT INTO recipes (Title, Ingredients, Instructions, Image_Name) VALUES (?, ?, ?, ?)',
+            [make_recipe(rng, number) for number in range(start, min(recipes, start + batch_size))]
+        )
+        conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic recipes.db")
+    parser.add_argument('--recipes', type=int, default=10000, help="number of recipes (10k to 1M is typical)")
+    parser.add_argument('--out', default='backend/bench/recipes.db')
+    parser.add_argument('--seed', type=int, default=0, help="same seed, same database")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    started = time.perf_counter()
+    generate(args.out, args.recipes, args.seed)
+    print(f"Wrote {args.recipes} recipes to {args.out} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,116 @@
+import re
+import sqlite3
+from functools import lru_cache
+
+WORD_PATTERN = re.compile(r'\b\w+\b')
+
+INGREDIENT_ADJECTIVES = {
+    'fresh', 'dried', 'frozen', 'canned', 'organic', 'chopped', 'minced',
+    'grated', 'sliced', 'ground', 'roasted', 'raw', 'cooked', 'smoked',
+    'sweet', 'sour', 'spicy', 'boneless', 'skinless', 'whole', 'low-fat',
+    'non-fat', 'extra-virgin', 'cold-pressed', 'pure', 'natural', 'artificial',
+    'light', 'dark', 'powdered', 'crushed', 'peeled', 'seeded', 'diced',
+    'shredded', 'cubed', 'marinated', 'pickled', 'aged', 'unsalted', 'salted',
+    'sweetened', 'unsweetened', 'flavored', 'unflavored', 'premium', 'homemade',
+    'store-bought', 'crispy', 'soft', 'hard', 'mild', 'hot', 'ripe', 'unripe',
+    'bitter', 'creamy', 'crunchy', 'juicy', 'lean', 'fatty', 'thick', 'thin',
+    'liquid', 'dry', 'moist', 'tender', 'tough', 'wild', 'cultivated', 'pasteurized',
+    'unpasteurized', 'gluten-free', 'vegan', 'vegetarian', 'kosher', 'halal'
+}
+
+def split_ingredients(ingredients_text):
+    # Same split the recipe table has always used: one ingredient per comma
+    if not ingredients_text:
+        return []
+    return [ing.strip() for ing in ingredients_text.split(',')]
+
+def tokenize(text):
+    return set(WORD_PATTERN.findall(text))
+
+@lru_cache(maxsize=65536)
+def normalize_ingredient(ingredient):
+    """Lowercase an ingredient and drop descriptive adjectives, e.g. "Fresh Milk" -> "milk"."""
+    ingredient_words = WORD_PATTERN.findall(ingredient.lower().strip())
+    return ' '.join([word for word in ingredient_words
+                     if word not in INGREDIENT_ADJECTIVES])
+
+def product_forms(product_name, category):
+    """Lowercased name and category plus their word set, computed once when a product is scanned."""
+    product_name = product_name.lower()
+    product_category = category.lower() if category else ""
+    return product_name, product_category, tokenize(f"{product_name} {product_category}")
+
+def normalize_product(product):
+    # Products read back from scanned_products carry their precomputed forms
+    if product.get("tokens") is not None:
+        return product["normalized_name"], product["normalized_category"], product["tokens"]
+    return product_forms(product["name"], product["category"])
+
+def check_product_matches_ingredient(product, ingredient):
+    # Normalize and remove adjectives
+    base_ingredient = normalize_ingredient(ingredient)
+
+    if not base_ingredient:
+        return False
+
+    product_name, product_category, product_words = normalize_product(product)
+
+    # Check base matches
+    if (base_ingredient in product_name or
+        product_name in base_ingredient or
+        base_ingredient in product_category):
+        return True
+
+    # Check word components
+    base_words = tokenize(base_ingredient)
+
+    # Require at least 3-letter matches to avoid short word false positives
+    meaningful_matches = [word for word in base_words
+                        if word in product_words and len(word) > 2]
+
+    return len(meaningful_matches) > 0
+
+class IngredientForms:
+    """
+    Base form and word set of every recipe ingredient, kept in a sidecar SQLite file
+    so the adjective-stripping regex runs once per distinct ingredient string, not on
+    every index rebuild or request.
+    """
+
+    def __init__(self, db_path='backend/ingredient_forms.db'):
+        self.db_path = db_path
+        self.forms = {}
+        self.new_forms = {}
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ingredient_forms (
+                ingredient TEXT PRIMARY KEY,
+                base TEXT,
+                tokens TEXT
+            )
+        ''')
+        for ingredient, base, tokens in conn.execute('SELECT ingredient, base, tokens FROM ingredient_forms'):
+            self.forms[ingredient] = (base, frozenset(tokens.split()))
+        conn.close()
+
+    def get(self, ingredient):
+        form = self.forms.get(ingredient)
+        if form is None:
+            base = normalize_ingredient(ingredient)
+            form = (base, frozenset(tokenize(base)))
+            self.forms[ingredient] = self.new_forms[ingredient] = form
+        return form
+
+    def save(self):
+        if not self.new_forms:
+            return
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany(
+            'INSERT OR REPLACE INTO ingredient_forms (ingredient, base, tokens) VALUES (?, ?, ?)',
+            [(ingredient, base, ' '.join(sorted(tokens)))
+             for ingredient, (base, tokens) in self.new_forms.items()]
+        )
+        conn.commit()
+        conn.close()
+        self.new_forms = {}
@@ -0,0 +1,219 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from db import ConnectionPool
+
+class JobFailed(Exception):
+    """Raised by a handler when retrying the job can't help."""
+
+class JobQueue:
+    """
+    Durable background jobs in SQLite, run by a pool of worker threads.
+
+    Handlers are registered per job kind, optionally with the upstream they call.
+    A worker only picks up a job when its upstream has a free slot, so however many
+    jobs are queued at most upstream_limits[upstream] calls to it are in flight. The
+    slots are counted in memory, so the limits hold per process: every process
+    running workers on the same database gets its own.
+    A handler that raises is retried with exponential backoff and jitter, up to
+    max_attempts, JobFailed fails it right away. Jobs left running by a process that
+    died are queued again once their lease has expired.
+
+    Jobs are grouped (e.g. everything one /scan upload started) for status polling,
+    and a job enqueued with a key isn't queued twice while one with that key waits.
+    """
+
+    def __init__(self, db_path='backend/jobs.db', workers=4, upstream_limits=None, max_attempts=5,
+                 base_delay=1.0, max_delay=300, lease=600, keep_finished=24 * 3600, poll_interval=1.0):
+        self.db = ConnectionPool(db_path)
+        self.workers = workers
+        self.upstream_limits = dict(upstream_limits or {})
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.keep_finished = keep_finished
+        self.poll_interval = poll_interval
+
+        self.handlers = {}  # kind -> (handler, upstream)
+        self._in_flight = defaultdict(int)  # upstream -> jobs running in this process
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._last_purge = 0
+        self.stats = {"enqueued": 0, "completed": 0, "retried": 0, "failed": 0}
+
+    def register(self, kind, handler, upstream=None):
+        """handler(payload) -> JSON-serializable result, called on a worker thread."""
+        self.handlers[kind] = (handler, upstream)
+
+    def init_db(self):
+        with self.db.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT,
+                    payload TEXT,
+                    job_group TEXT,
+                    job_key TEXT,
+                    status TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    run_at REAL,
+                    created_at REAL,
+                    updated_at REAL,
+                    result TEXT,
+                    error TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_runnable ON jobs (status, run_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_group ON jobs (job_group)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (job_key, status)')
+            conn.commit()
+
+    def enqueue(self, kind, payload, group=None, key=None, delay=0):
+        """Queue a job, returns its id (the waiting job's id when one with the same key is queued)."""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler for job kind {kind}")
+        now = time.time()
+        with self.db.connection() as conn:
+            with conn:
+                if key is not None:
+                    existing = conn.execute('SELECT id FROM jobs WHERE job_key = ? AND status = ?',
+                                            (key, 'queued')).fetchone()
+                    if existing is not None:
+                        return existing[0]
+                job_id = conn.execute('''
+                    INSERT INTO jobs (kind, payload, job_group, job_key, status, run_at, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)
+                ''', (kind, json.dumps(payload), group, key, now + delay, now, now)).lastrowid
+        with self._wakeup:
+            self.stats["enqueued"] += 1
+            self._wakeup.notify()
+        return job_id
+
+    def status(self, group):
+        """Every job of a group as dicts (id, kind, status, attempts, result, error), oldest first."""
+        with self.db.connection() as conn:
+            rows = conn.execute('''
+                SELECT id, kind, payload, status, attempts, result, error FROM jobs
+                WHERE job_group = ? ORDER BY id
+            ''', (group,)).fetchall()
+        return [{
+            "id": job_id,
+            "kind": kind,
+            "payload": json.loads(payload),
+            "status": status,
+            "attempts": attempts,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+        } for job_id, kind, payload, status, attempts, result, error in rows]
+
+    @property
+    def running(self):
+        """Whether start() ran in this process."""
+        return bool(self._threads)
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _claim(self):
+        """Mark the next runnable job as running and return (id, kind, payload, attempts), or None."""
+        now = time.time()
+        with self._wakeup:
+            kinds = [kind for kind, (_, upstream) in self.handlers.items()
+                     if upstream is None or self._in_flight[upstream] < self.upstream_limits.get(upstream, 1)]
+            if not kinds:
+                return None
+            placeholders = ', '.join('?' for _ in kinds)
+            with self.db.connection() as conn:
+                with conn:
+                    # Running jobs whose process died, their lease is long over
+                    conn.execute('''
+                        UPDATE jobs SET status = 'queued', run_at = ?
+                        WHERE status = 'running' AND updated_at < ?
+                    ''', (now, now - self.lease))
+                    for job_id, kind, payload, attempts in conn.execute(f'''
+                        SELECT id, kind, payload, attempts FROM jobs
+                        WHERE status = 'queued' AND run_at <= ? AND kind IN ({placeholders})
+                        ORDER BY run_at, id LIMIT 8
+                    ''', [now, *kinds]).fetchall():
+                        # Another process may have taken it in the meantime
+                        claimed = conn.execute('''
+                            UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?
+                            WHERE id = ? AND status = 'queued'
+                        ''', (now, job_id)).rowcount
+                        if claimed:
+                            upstream = self.handlers[kind][1]
+                            if upstream is not None:
+                                self._in_flight[upstream] += 1
+                            return job_id, kind, json.loads(payload), attempts + 1
+        return None
+
+    def _finish(self, job_id, status, result=None, error=None, run_at=None):
+        with self.db.connection() as conn:
+            conn.execute('''
+                UPDATE jobs SET status = ?, result = ?, error = ?, run_at = COALESCE(?, run_at), updated_at = ?
+                WHERE id = ?
+            ''', (status, json.dumps(result) if result is not None else None, error, run_at, time.time(), job_id))
+            conn.commit()
+
+    def _run(self, job_id, kind, payload, attempts):
+        handler, upstream = self.handlers[kind]
+        stat = None
+        try:
+            try:
+                result = handler(payload)
+            except Exception as e:
+                if isinstance(e, JobFailed) or attempts >= self.max_attempts:
+                    print(f"Job {job_id} ({kind}) failed after {attempts} attempts: {str(e)}")
+                    self._finish(job_id, 'failed', error=str(e))
+                    stat = "failed"
+                else:
+                    delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+                    self._finish(job_id, 'queued', error=str(e), run_at=time.time() + delay)
+                    stat = "retried"
+            else:
+                self._finish(job_id, 'done', result=result)
+                stat = "completed"
+        finally:
+            # Also when recording the outcome failed: the job is picked up again once its
+            # lease is over, the upstream slot must not stay taken until then
+            with self._wakeup:
+                if stat is not None:
+                    self.stats[stat] += 1
+                if upstream is not None:
+                    self._in_flight[upstream] -= 1
+                # A slot came free, another worker may be waiting for it
+                self._wakeup.notify()
+
+    def _purge(self):
+        now = time.time()
+        with self._wakeup:
+            if now - self._last_purge < 3600:
+                return
+            self._last_purge = now
+        with self.db.connection() as conn:
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                         (now - self.keep_finished,))
+            conn.commit()
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+                if job is None:
+                    self._purge()
+                    with self._wakeup:
+                        self._wakeup.wait(self.poll_interval)
+                    continue
+                self._run(*job)
+            except Exception as e:
+                print(f"Job worker error: {str(e)}")
+                time.sleep(self.poll_interval)
@@ -0,0 +1,341 @@
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import requests
+
+import metrics
+from db import ConnectionPool
+
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'qwen2.5')
+
+PROMPT_TEMPLATE = """
+    You are a helpful cooking assistant in a food app.
+    Format these instructions for "{recipe_title}" into a clear, numbered step-by-step guide.
+    Keep it concise and easy to follow. Start directly with the numbered steps.
+    Do not include any introductory text, disclaimers, or phrases like "Here's the recipe" or "Here are the steps".
+    Just provide the numbered steps, formatted for mobile app display.
+
+    Raw instructions:
+    {raw_instructions}
+    """
+
+# Cached output is only reused for the same model and prompt
+PROMPT_HASH = hashlib.sha1(f"{OLLAMA_MODEL}\n{PROMPT_TEMPLATE}".encode()).hexdigest()[:16]
+
+def build_prompt(raw_instructions, recipe_title):
+    return PROMPT_TEMPLATE.format(recipe_title=recipe_title, raw_instructions=raw_instructions)
+
+def clean_response(response_text):
+    # Remove any common prefixes that the LLM might still add
+    return re.sub(r'^(Sure!|Here is|Here are|These are|Following are|Step-by-step guide:?)\s*', '', response_text, flags=re.IGNORECASE).strip()
+
+def generate_request(raw_instructions, recipe_title, stream=False):
+    return {"model": OLLAMA_MODEL, "prompt": build_prompt(raw_instructions, recipe_title), "stream": stream}
+
+def parse_generate_response(response_json, response_text):
+    if "response" not in response_json:
+        raise ValueError(f"Unexpected Ollama response: {response_text[:200]}")
+    return clean_response(response_json["response"])
+
+def process_instructions_with_qwen(raw_instructions, recipe_title, timeout=60):
+    """
+    Uses the locally running Qwen model via Ollama to refine recipe instructions.
+
+    :param raw_instructions: The unstructured recipe instructions from the database.
+    :param recipe_title: The title of the recipe for context.
+    :param timeout: Seconds to wait for Ollama before giving up.
+    :return: A cleaned, structured, and numbered list of steps.
+    :raises: requests.RequestException or ValueError when Ollama fails.
+    """
+    response = requests.post(
+        f"{OLLAMA_URL}/api/generate",
+        json=generate_request(raw_instructions, recipe_title),
+        timeout=timeout
+    )
+    response.raise_for_status()
+    return parse_generate_response(response.json(), response.text)
+
+def stream_instructions_with_qwen(raw_instructions, recipe_title, timeout=60):
+    """
+    Same as process_instructions_with_qwen but yields the text chunks as Ollama generates them.
+    Raises ValueError when the stream ends before Ollama marks it done.
+    """
+    with requests.post(
+        f"{OLLAMA_URL}/api/generate",
+        json=generate_request(raw_instructions, recipe_title, stream=True),
+        timeout=timeout,
+        stream=True
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                return
+    raise ValueError("Ollama stream ended before it was done")
+
+class InstructionCache:
+    """
+    Formatted instructions by (recipe_id, prompt hash), persisted in SQLite. With a
+    SharedCache, instructions other instances formatted are reused too.
+    """
+
+    def __init__(self, db_path='backend/instructions_cache.db', prompt_hash=PROMPT_HASH, shared=None):
+        self.db = ConnectionPool(db_path)
+        self.prompt_hash = prompt_hash
+        self.shared = shared
+
+    def _key(self, recipe_id):
+        return f"instructions:{self.prompt_hash}:{recipe_id}"
+
+    def init_db(self):
+        with self.db.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS formatted_instructions (
+                    recipe_id INTEGER,
+                    prompt_hash TEXT,
+                    instructions TEXT,
+                    created_at REAL,
+                    PRIMARY KEY (recipe_id, prompt_hash)
+                )
+            ''')
+            conn.commit()
+
+    def get_many(self, recipe_ids):
+        if not recipe_ids:
+            return {}
+        placeholders = ', '.join('?' for _ in recipe_ids)
+        with self.db.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT recipe_id, instructions FROM formatted_instructions
+                WHERE prompt_hash = ? AND recipe_id IN ({placeholders})
+            ''', [self.prompt_hash] + list(recipe_ids)).fetchall()
+        cached = dict(rows)
+        missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in cached]
+        if self.shared is not None and missing:
+            shared = self.shared.get_many([self._key(recipe_id) for recipe_id in missing])
+            for recipe_id in missing:
+                if self._key(recipe_id) in shared:
+                    cached[recipe_id] = shared[self._key(recipe_id)]
+                    self.put(recipe_id, cached[recipe_id], publish=False)
+        return cached
+
+    def coalesce(self, recipe_id, fill):
+        """fill() once for concurrent formatting of the same recipe, across instances with a SharedCache."""
+        if self.shared is None:
+            return fill()
+        return self.shared.coalesce(self._key(recipe_id), fill)
+
+    async def coalesce_async(self, recipe_id, fill):
+        if self.shared is None:
+            return await fill()
+        return await self.shared.coalesce_async(self._key(recipe_id), fill)
+
+    def put(self, recipe_id, instructions, publish=True):
+        if publish and self.shared is not None:
+            self.shared.set(self._key(recipe_id), instructions)
+        with self.db.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO formatted_instructions (recipe_id, prompt_hash, instructions, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (recipe_id, self.prompt_hash, instructions, time.time()))
+            conn.commit()
+
+class InstructionFormatter:
+    """
+    Formats recipe instructions with the LLM through InstructionCache.
+
+    Cache misses for one request are formatted concurrently and bounded by
+    `timeout`; a call that overruns is left to finish in the background and still
+    fills the cache, while the request falls back to the raw instructions. A
+    background worker pre-formats recipes queued with prefetch().
+    """
+
+    def __init__(self, cache, load_recipes, concurrency=2, timeout=20):
+        self.cache = cache
+        self.load_recipes = load_recipes  # recipe ids -> {id: (title, raw instructions)}
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='llm')
+        self._prefetch_queue = queue.Queue(maxsize=1000)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._background = set()  # async formatting still running after its request timed out
+
+    def _format_and_store(self, recipe_id, title, raw_instructions):
+        def format_and_store():
+            instructions = process_instructions_with_qwen(raw_instructions, title)
+            self.cache.put(recipe_id, instructions)
+            return instructions
+
+        return self.cache.coalesce(recipe_id, format_and_store)
+
+    def format_many(self, recipes):
+        """recipes: [(recipe_id, title, raw instructions)] -> formatted instructions in the same order."""
+        cached = self.cache.get_many([recipe_id for recipe_id, _, _ in recipes])
+        metrics.tag('hit' if len(cached) == len(recipes) else 'miss')
+        futures = {
+            recipe_id: self._pool.submit(self._format_and_store, recipe_id, title, raw_instructions)
+            for recipe_id, title, raw_instructions in recipes
+            if recipe_id not in cached
+        }
+
+        deadline = time.monotonic() + self.timeout
+        results = []
+        for recipe_id, title, raw_instructions in recipes:
+            if recipe_id in cached:
+                results.append(cached[recipe_id])
+                continue
+            try:
+                results.append(futures[recipe_id].result(timeout=max(0, deadline - time.monotonic())))
+            except TimeoutError:
+                print(f"Formatting timed out for recipe {recipe_id}, using raw instructions")
+                results.append(raw_instructions)
+            except Exception as e:
+                print(f"Formatting failed for recipe {recipe_id}: {str(e)}")
+                results.append(raw_instructions)
+        return results
+
+    async def format_many_async(self, recipes, generate):
+        """
+        format_many() for the async server. `generate(raw instructions, title)` is a
+        coroutine function asking the LLM, its connection pool caps how many run at once.
+        The cache is read and written in the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, self.cache.get_many, [recipe_id for recipe_id, _, _ in recipes])
+        metrics.tag('hit' if len(cached) == len(recipes) else 'miss')
+
+        async def format_and_store(recipe_id, title, raw_instructions):
+            async def generate_and_store():
+                instructions = await generate(raw_instructions, title)
+                await loop.run_in_executor(None, self.cache.put, recipe_id, instructions)
+                return instructions
+
+            return await self.cache.coalesce_async(recipe_id, generate_and_store)
+
+        tasks = {
+            recipe_id: asyncio.create_task(format_and_store(recipe_id, title, raw_instructions))
+            for recipe_id, title, raw_instructions in recipes
+            if recipe_id not in cached
+        }
+        if tasks:
+            await asyncio.wait(tasks.values(), timeout=self.timeout)
+
+        results = []
+        for recipe_id, title, raw_instructions in recipes:
+            if recipe_id in cached:
+                results.append(cached[recipe_id])
+                continue
+            task = tasks[recipe_id]
+            if not task.done():
+                print(f"Formatting timed out for recipe {recipe_id}, using raw instructions")
+                # Keep it running so it still fills the cache
+                self._background.add(task)
+                task.add_done_callback(self._background_done)
+                results.append(raw_instructions)
+            elif task.exception() is not None:
+                print(f"Formatting failed for recipe {recipe_id}: {str(task.exception())}")
+                results.append(raw_instructions)
+            else:
+                results.append(task.result())
+        return results
+
+    def _background_done(self, task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Background formatting failed: {str(task.exception())}")
+
+    def stream(self, recipe_id, title, raw_instructions):
+        """
+        Yields ("delta", text chunk) while the LLM generates, then one ("instructions", full text).
+        Cache hits and failures go straight to the final event. Only a complete, non-empty
+        answer is cached, a cut off or empty stream ends with the raw instructions.
+        """
+        cached = self.cache.get_many([recipe_id])
+        metrics.tag('hit' if recipe_id in cached else 'miss')
+        if recipe_id in cached:
+            yield "instructions", cached[recipe_id]
+            return
+        chunks = []
+        try:
+            for chunk in stream_instructions_with_qwen(raw_instructions, title, timeout=self.timeout):
+                chunks.append(chunk)
+                yield "delta", chunk
+        except Exception as e:
+            print(f"Formatting failed for recipe {recipe_id}: {str(e)}")
+            yield "instructions", raw_instructions
+            return
+        instructions = clean_response(''.join(chunks))
+        if not instructions:
+            print(f"Formatting failed for recipe {recipe_id}: empty answer")
+            yield "instructions", raw_instructions
+            return
+        self.cache.put(recipe_id, instructions)
+        yield "instructions", instructions
+
+    def prefetch(self, recipe_ids):
+        """Queue recipes to be formatted ahead of time by the background worker."""
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._prefetch_loop, name='llm-prefetch', daemon=True)
+                self._worker.start()
+            for recipe_id in recipe_ids:
+                if recipe_id in self._queued:
+                    continue
+                try:
+                    self._prefetch_queue.put_nowait(recipe_id)
+                except queue.Full:
+                    return
+                self._queued.add(recipe_id)
+
+    def _prefetch_loop(self):
+        while True:
+            recipe_id = self._prefetch_queue.get()
+            try:
+                if not self.cache.get_many([recipe_id]):
+                    recipe = self.load_recipes([recipe_id]).get(recipe_id)
+                    if recipe:
+                        self._format_and_store(recipe_id, *recipe)
+            except Exception as e:
+                print(f"Prefetch failed for recipe {recipe_id}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._queued.discard(recipe_id)
+
+if __name__ == "__main__":
+    import argparse
+    import sqlite3
+
+    parser = argparse.ArgumentParser(description="Pre-format recipe instructions into the instruction cache")
+    parser.add_argument('--recipes', default='backend/recipes.db')
+    parser.add_argument('--cache', default='backend/instructions_cache.db')
+    parser.add_argument('--limit', type=int, default=None, help="only the first N recipes")
+    args = parser.parse_args()
+
+    cache = InstructionCache(args.cache)
+    cache.init_db()
+    conn = sqlite3.connect(args.recipes)
+    query = 'SELECT id, Title, Instructions FROM recipes ORDER BY id'
+    if args.limit:
+        query += f' LIMIT {int(args.limit)}'
+    for recipe_id, title, raw_instructions in conn.execute(query):
+        if cache.get_many([recipe_id]):
+            continue
+        try:
+            cache.put(recipe_id, process_instructions_with_qwen(raw_instructions, title))
+            print(f"Formatted recipe {recipe_id}: {title}")
+        except Exception as e:
+            print(f"Failed recipe {recipe_id}: {str(e)}")
+    conn.close()
@@ -0,0 +1,193 @@
+# Concurrent load on /scan and /generate_recipe. Every simulated session uploads a
+# few photos, then asks for recipes; latency percentiles and throughput are
+# reported per endpoint.
+#
+# Against a server that is already running:
+#   python backend/loadtest.py --url http://localhost:8000 --sessions 100 --concurrency 16
+# Or self-contained: start the upstream stand-ins and a backend (Flask or async) on
+# a synthetic recipe table, then load it:
+#   python backend/gen_recipes.py --recipes 100000 --out /tmp/bench/recipes.db
+#   python backend/loadtest.py --spawn async --recipes-db /tmp/bench/recipes.db --latency 0.05
+# Sessions re-upload the same sample photos, so a spawned backend runs without the
+# decoded image cache (--scan-cache keeps it) and every /scan includes decoding.
+# A server started by hand should run with SCAN_CACHE_SIZE=0 for the same reason.
+import argparse
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stub_servers import BingImagesHandler, OllamaHandler, OpenFoodFactsHandler, start_server
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a list of numbers, q in 0-100."""
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    rank = min(len(ordered), max(1, math.ceil(q / 100 * len(ordered)))) - 1
+    return ordered[rank]
+
+def summarize(name, samples, errors, elapsed):
+    """One report line: count, errors, throughput and latency percentiles in ms."""
+    def ms(q):
+        return percentile(samples, q) * 1000
+    throughput = len(samples) / elapsed if elapsed else float('nan')
+    return (f"{name:<18}{len(samples):>7}{errors:>7}{throughput:>10.1f}/s"
+            f"{ms(50):>10.1f}{ms(95):>10.1f}{ms(99):>10.1f}{max(samples, default=0) * 1000:>10.1f}")
+
+REPORT_HEADER = f"{'':<18}{'reqs':>7}{'errors':>7}{'throughput':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+
+class LoadRecorder:
+    def __init__(self):
+        self.latencies = {}  # endpoint -> [seconds]
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, elapsed, ok):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + (not ok)
+
+def load_images(directory):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), 'rb') as f:
+                images.append((name, f.read()))
+    return images
+
+def run_session(base_url, images, images_per_scan, scans, recorder, rng, local):
+    # One HTTP session (keep-alive) per worker thread
+    http = getattr(local, 'http', None)
+    if http is None:
+        http = local.http = requests.Session()
+    session_id = str(uuid.uuid4())
+
+    for _ in range(scans):
+        files = [('images', (name, data, 'image/jpeg')) for name, data in rng.sample(images, min(images_per_scan, len(images)))]
+        started = time.perf_counter()
+        try:
+            ok = http.post(f"{base_url}/scan", files=files, data={'session_id': session_id}, timeout=120).ok
+        except requests.RequestException:
+            ok = False
+        recorder.record('/scan', time.perf_counter() - started, ok)
+
+    started = time.perf_counter()
+    try:
+        ok = http.post(f"{base_url}/generate_recipe", json={'session_id': session_id}, timeout=120).ok
+    except requests.RequestException:
+        ok = False
+    recorder.record('/generate_recipe', time.perf_counter() - started, ok)
+
+def run_load(base_url, images, sessions, concurrency, images_per_scan=2, scans=1, seed=0):
+    """Run `sessions` sessions, `concurrency` at a time. Returns (LoadRecorder, wall seconds)."""
+    recorder = LoadRecorder()
+    local = threading.local()
+    rngs = [random.Random(seed + i) for i in range(sessions)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(run_session, base_url, images, images_per_scan, scans, recorder, rng, local)
+                       for rng in rngs]:
+            future.result()
+    return recorder, time.perf_counter() - started
+
+def report(recorder, elapsed, sessions):
+    print(REPORT_HEADER)
+    for endpoint in ('/scan', '/generate_recipe'):
+        samples = recorder.latencies.get(endpoint, [])
+        print(summarize(endpoint, samples, recorder.errors.get(endpoint, 0), elapsed))
+    print(f"{sessions} sessions in {elapsed:.1f}s, {sessions / elapsed:.1f} sessions/s")
+
+def wait_until_up(base_url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}")
+        try:
+            requests.get(f"{base_url}/cache_stats", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.25)
+    raise RuntimeError("Backend did not come up in time")
+
+def spawn_backend(kind, recipes_db, port, upstream_ports, workdir, scan_cache=False):
+    """Start main.py (Flask) or async_app.py in workdir, with backend/recipes.db pointing at recipes_db."""
+    os.makedirs(os.path.join(workdir, 'backend'), exist_ok=True)
+    shutil.copyfile(recipes_db, os.path.join(workdir, 'backend', 'recipes.db'))
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': os.pathsep.join(filter(None, [BACKEND_DIR, env.get('PYTHONPATH')])),
+        'OPENFOODFACTS_URL': f"http://localhost:{upstream_ports[0]}",
+        'OLLAMA_URL': f"http://localhost:{upstream_ports[1]}",
+        'BING_IMAGES_URL': f"http://localhost:{upstream_ports[2]}/images/search",
+        'THUMBNAIL_PREFETCH': '0',
+    })
+    if not scan_cache:
+        env['SCAN_CACHE_SIZE'] = '0'
+    if kind == 'flask':
+        command = [sys.executable, '-c', f"import main; main.init_db(); main.app.run(port={port}, threaded=True)"]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'async_app:app', '--app-dir', BACKEND_DIR,
+                   '--port', str(port), '--log-level', 'warning']
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /scan and /generate_recipe")
+    parser.add_argument('--url', default='http://localhost:8000', help="backend to load when not spawning one")
+    parser.add_argument('--spawn', choices=['flask', 'async'], help="start stand-ins and a backend for the run")
+    parser.add_argument('--recipes-db', default='backend/recipes.db', help="recipe table for the spawned backend")
+    parser.add_argument('--latency', type=float, default=0.05, help="stand-in upstream latency in seconds")
+    parser.add_argument('--port', type=int, default=8100, help="spawned backend port, stand-ins use the next three")
+    parser.add_argument('--images', default=os.path.join(BACKEND_DIR, 'img'))
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--images-per-scan', type=int, default=2)
+    parser.add_argument('--scans', type=int, default=1, help="/scan calls per session before /generate_recipe")
+    parser.add_argument('--warmup', type=int, default=5, help="sessions run first and left out of the report")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scan-cache', action='store_true',
+                        help="keep the spawned backend's decoded image cache, /scan then mostly skips decoding")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+
+    base_url = args.url
+    process = workdir = None
+    servers = []
+    try:
+        if args.spawn:
+            upstream_ports = (args.port + 1, args.port + 2, args.port + 3)
+            for handler, port in zip((OpenFoodFactsHandler, OllamaHandler, BingImagesHandler), upstream_ports):
+                servers.append(start_server(handler, port, args.latency))
+            workdir = tempfile.mkdtemp(prefix='loadtest-')
+            process = spawn_backend(args.spawn, args.recipes_db, args.port, upstream_ports, workdir, args.scan_cache)
+            base_url = f"http://localhost:{args.port}"
+            wait_until_up(base_url, process)
+            print(f"Spawned {args.spawn} backend on {base_url} (logs in {workdir}/server.log), upstream latency {args.latency}s")
+
+        if args.warmup:
+            run_load(base_url, images, args.warmup, args.concurrency, args.images_per_scan, args.scans, args.seed + 10**6)
+        recorder, elapsed = run_load(base_url, images, args.sessions, args.concurrency,
+                                     args.images_per_scan, args.scans, args.seed)
+        report(recorder, elapsed, args.sessions)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        for server in servers:
+            server.shutdown()
@@ -1,20 +1,77 @@
-from flask import Flask, request, jsonify
-import cv2
-from pyzbar.pyzbar import decode
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 import requests
 import sqlite3
-import re
 import os
 import json
+import queue
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from bs4 import BeautifulSoup
+
+import metrics
+from db import ConnectionPool
+from ingredients import product_forms
+from jobs import JobFailed, JobQueue
+from llm import InstructionCache, InstructionFormatter, process_instructions_with_qwen
+from match_log import MatchLog
+from product_cache import ProductCache
+from product_dump import LocalProductTable
+from ranking import RankingCursors, RankingOptions, decode_cursor, encode_cursor, request_offset, top_matches
+from recipe_index import RecipeIndexLoader
+from recipe_matrix import RecipeMatrixLoader
+from session_state import SessionMatchCache
+from shared_cache import SharedCache, open_backend
+from categories import CategoryClassifier
+from scan_cache import ScanCache
+from scanner import scan_barcodes
+from sessions import start_retention_job
+from thumbnails import ThumbnailStore
 
 app = Flask(__name__)
 
+# /scan pipeline: barcode decoding and product lookups run on shared pools, the
+# lookup pool size caps concurrent OpenFoodFacts requests across all uploads
+SCAN_DECODE_WORKERS = int(os.environ.get('SCAN_DECODE_WORKERS', os.cpu_count() or 2))
+SCAN_LOOKUP_CONCURRENCY = int(os.environ.get('SCAN_LOOKUP_CONCURRENCY', 4))
+decode_pool = ThreadPoolExecutor(max_workers=SCAN_DECODE_WORKERS, thread_name_prefix='decode')
+lookup_pool = ThreadPoolExecutor(max_workers=SCAN_LOOKUP_CONCURRENCY, thread_name_prefix='lookup')
+# Decoded barcodes of recent uploads, re-uploads and near-identical shots of the same
+# session skip decoding.
+# SCAN_CACHE_SIZE=0 turns it off.
+scan_cache = ScanCache(
+    max_entries=int(os.environ.get('SCAN_CACHE_SIZE', 1024)),
+    max_distance=int(os.environ.get('SCAN_CACHE_DISTANCE', 8)),
+)
+
+# Pooled connections, products.db in WAL mode and recipes.db opened read-only
+products_db = ConnectionPool('backend/products.db', row_factory=sqlite3.Row)
+recipes_db = ConnectionPool('backend/recipes.db', read_only=True, row_factory=sqlite3.Row)
+
+# Sessions idle for longer than this are moved to products_archive.db
+SESSION_RETENTION_DAYS = int(os.environ.get('SESSION_RETENTION_DAYS', 30))
+
+# Ingredient index over recipes.db, rebuilt whenever the recipe table changes.
+# MATCH_MODE "strict" matches products on substrings and whole words only, "fuzzy"
+# also on plurals and near spellings scoring at least FUZZY_THRESHOLD.
+MATCH_MODE = os.environ.get('MATCH_MODE', 'strict')
+FUZZY_THRESHOLD = float(os.environ.get('FUZZY_THRESHOLD', 0.6))
+# With RECIPE_SNAPSHOT=1 (the default) the index is served from a memory-mapped columnar
+# snapshot that every worker process shares, rebuild it with backend/recipe_snapshot.py.
+RECIPE_SNAPSHOT = os.environ.get('RECIPE_SNAPSHOT', '1') == '1'
+recipe_index = RecipeIndexLoader('backend/recipes.db', match_mode=MATCH_MODE, fuzzy_threshold=FUZZY_THRESHOLD,
+                                 snapshot_dir='backend/recipe_snapshot' if RECIPE_SNAPSHOT else None)
+# Scoring engine: "session" keeps every active session's match counts in memory and
+# updates them as products are saved, "index" counts through the inverted index on
+# every request, "matrix" uses a sparse NumPy matrix-vector product with a partial
+# sort. All three return the same ranking.
+SCORING_ENGINE = os.environ.get('SCORING_ENGINE', 'session')
+recipe_matrix = RecipeMatrixLoader(recipe_index, 'backend/recipe_matrix.npz')
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 1000))
+SESSION_CACHE_TTL = int(os.environ.get('SESSION_CACHE_TTL', 3600))
+
 # Database initialization
-def init_db():
-    # Create products database
-    conn = sqlite3.connect('backend/products.db')
+def create_products_table(conn):
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS scanned_products (
@@ -23,183 +80,397 @@ def init_db():
             product_name TEXT,
             category TEXT,
             scan_date TIMESTAMP,
-            session_id TEXT
+            session_id TEXT,
+            normalized_name TEXT,
+            normalized_category TEXT,
+            tokens TEXT
         )
     ''')
+    # Older databases predate the precomputed matching columns
+    columns = {row[1] for row in c.execute('PRAGMA table_info(scanned_products)')}
+    for column in ('normalized_name', 'normalized_category', 'tokens'):
+        if column not in columns:
+            c.execute(f'ALTER TABLE scanned_products ADD COLUMN {column} TEXT')
     conn.commit()
-    conn.close()
+    migrate_products_db(conn)
+
+# Schema migrations for products.db, applied in order and tracked with PRAGMA user_version
+def add_session_inventory(c):
+    # Session lookups no longer scan the whole scan history
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scanned_products_session
+        ON scanned_products (session_id, scan_date)
+    ''')
+    # One row per product per session, however many times it was scanned
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS session_inventory (
+            session_id TEXT,
+            barcode TEXT,
+            product_name TEXT,
+            category TEXT,
+            normalized_name TEXT,
+            normalized_category TEXT,
+            tokens TEXT,
+            first_scanned TIMESTAMP,
+            last_scanned TIMESTAMP,
+            scan_count INTEGER,
+            PRIMARY KEY (session_id, barcode)
+        )
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO session_inventory
+        SELECT session_id, barcode, product_name, category, normalized_name, normalized_category,
+               tokens, MIN(scan_date), MAX(scan_date), COUNT(*)
+        FROM scanned_products
+        GROUP BY session_id, barcode
+    ''')
+
+def add_specific_category(c):
+    # Most specific food category of the product, picked from its category list at scan time
+    c.execute('ALTER TABLE scanned_products ADD COLUMN specific_category TEXT')
+    c.execute('ALTER TABLE session_inventory ADD COLUMN specific_category TEXT')
+
+PRODUCTS_DB_MIGRATIONS = [
+    add_session_inventory,
+    add_specific_category,
+]
+
+def migrate_products_db(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(PRODUCTS_DB_MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        with conn:
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {number}')
+        print(f"Migrated products.db to version {number} ({migration.__name__})")
+
+def init_db():
+    # Create products database
+    with products_db.connection() as conn:
+        create_products_table(conn)
     
-    # Ensure recipe database connection works
-    recipe_conn = sqlite3.connect('backend/recipes.db')
-    recipe_conn.row_factory = sqlite3.Row
-    recipe_conn.close()
+    shared_cache.init_db()
+    product_cache.init_db()
+    instruction_cache.init_db()
+    thumbnail_store.init_db()
+    job_queue.init_db()
+    category_classifier.load()
+
+    # Ensure recipe database connection works and build the ingredient index up front
+    recipe_index.get()
+    if SCORING_ENGINE == 'matrix':
+        recipe_matrix.get()
     
     # Create logs directory if it doesn't exist
     os.makedirs('backend/logs', exist_ok=True)
 
-# Barcode scanning functions
-def preprocess_image(image_path):
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError("Failed to load image")
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    _, thresh = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY)
-    return thresh
+# Product information functions
+OPENFOODFACTS_URL = os.environ.get('OPENFOODFACTS_URL', 'https://world.openfoodfacts.org')
 
-def scan_barcode(image_path):
-    try:
-        processed_image = preprocess_image(image_path)
-        barcodes = decode(processed_image)
-        
-        if not barcodes:
-            return None, "No barcode detected"
-            
-        for barcode in barcodes:
-            barcode_data = barcode.data.decode("utf-8")
-            return barcode_data, f"Barcode detected: {barcode_data}"
-            
-        return None, "No valid barcode found"
-    except Exception as e:
-        return None, f"Error processing barcode: {str(e)}"
+def fetch_product_info(barcode):
+    # Raises when OpenFoodFacts can't be reached, returns None when the product doesn't exist
+    url = f"{OPENFOODFACTS_URL}/api/v0/product/{barcode}.json"
+    response = requests.get(url, timeout=5)
+    response.raise_for_status()
+    return parse_product_response(barcode, response.json())
+
+def parse_product_response(barcode, data):
+    if "product" not in data:
+        return None
+
+    product = data["product"]
+
+    return {
+        "product_name": product.get("product_name", "Unknown Product"),
+        "category": product.get("categories", "Unknown Category"),
+        "barcode": barcode
+    }
+
+# Cache tier shared by backend instances, CACHE_BACKEND is "memory" (per process),
+# "sqlite:///path/to/cache.db" or "redis://host:port/db". Concurrent misses for one
+# barcode, recipe or thumbnail make a single upstream call through it.
+# CACHE_LOCK_TTL must outlast the slowest upstream call made under a lock (Ollama, up to 60 s).
+shared_cache = SharedCache(open_backend(os.environ.get('CACHE_BACKEND', 'memory')),
+                           lock_ttl=float(os.environ.get('CACHE_LOCK_TTL', 90)))
+product_cache = ProductCache(fetch_product_info, 'backend/product_cache.db', shared=shared_cache)
+# Offline import of the OpenFoodFacts export (see product_dump.py), checked before the network
+local_products = LocalProductTable('backend/openfoodfacts.db')
 
-# Product information functions
 def get_product_info(barcode):
-    url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
     try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        if "product" not in data:
-            return None
-            
-        product = data["product"]
-            
-        return {
-            "product_name": product.get("product_name", "Unknown Product"),
-            "category": product.get("categories", "Unknown Category"),
-            "barcode": barcode
-        }
+        with metrics.span('product_lookup'):
+            product_info = local_products.lookup(barcode)
+            if product_info:
+                metrics.tag('local')
+                return product_info
+            return product_cache.get(barcode)
     except Exception as e:
         print(f"Error fetching product info: {str(e)}")
         return None
 
-def save_product_to_db(product_info, session_id):
-    conn = sqlite3.connect('backend/products.db')
-    c = conn.cursor()
-    c.execute('''
+# WordNet is loaded once, classifying a category string is a few dict lookups after that
+category_classifier = CategoryClassifier()
+
+def product_rows(products, session_id):
+    """scanned_products rows of one upload, with the precomputed matching columns."""
+    rows = []
+    scan_date = datetime.now()
+    for product_info in products:
+        # Normalize once at scan time so recipe matching never has to re-tokenize
+        normalized_name, normalized_category, tokens = product_forms(
+            product_info['product_name'], product_info['category'])
+        rows.append((
+            product_info['barcode'],
+            product_info['product_name'],
+            product_info['category'],
+            scan_date,
+            session_id,
+            normalized_name,
+            normalized_category,
+            ' '.join(sorted(tokens)),
+            category_classifier.most_specific(product_info['category'])
+        ))
+    return rows
+
+def write_products(conn, rows, session_id):
+    """Insert one upload's rows in a single transaction, returns the session's versions before and after."""
+    # Holding the write lock from the start, the versions around the write are exact
+    conn.execute('BEGIN IMMEDIATE')
+    before = session_version(conn, session_id)
+    conn.executemany('''
         INSERT INTO scanned_products 
-        (barcode, product_name, category, scan_date, session_id)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        product_info['barcode'],
-        product_info['product_name'],
-        product_info['category'],
-        datetime.now(),
-        session_id
-    ))
+        (barcode, product_name, category, scan_date, session_id,
+         normalized_name, normalized_category, tokens, specific_category)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.executemany('''
+        INSERT INTO session_inventory
+        (barcode, product_name, category, first_scanned, session_id,
+         normalized_name, normalized_category, tokens, specific_category, last_scanned, scan_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+        ON CONFLICT (session_id, barcode) DO UPDATE SET
+            product_name = excluded.product_name,
+            category = excluded.category,
+            normalized_name = excluded.normalized_name,
+            normalized_category = excluded.normalized_category,
+            tokens = excluded.tokens,
+            specific_category = excluded.specific_category,
+            last_scanned = excluded.last_scanned,
+            scan_count = scan_count + 1
+    ''', [row + (row[3],) for row in rows])  # last_scanned is the scan date
+    after = session_version(conn, session_id)
     conn.commit()
-    conn.close()
+    return before, after
+
+def save_products_to_db(products, session_id):
+    """Insert every product from one upload in a single transaction."""
+    rows = product_rows(products, session_id)
+    with metrics.span('db_write'), products_db.connection() as conn:
+        before, after = write_products(conn, rows, session_id)
+
+    session_matches.add_products(session_id, [{
+        "barcode": row[0],
+        "name": row[1],
+        "category": row[2],
+        "normalized_name": row[5],
+        "normalized_category": row[6],
+        "tokens": set(row[7].split())
+    } for row in rows], before, after)
+
+def save_product_to_db(product_info, session_id):
+    save_products_to_db([product_info], session_id)
 
 # Recipe matching functions
+def read_session_products(conn, session_id):
+    products = conn.execute('''
+        SELECT barcode, product_name, category, normalized_name, normalized_category, tokens
+        FROM session_inventory WHERE session_id = ?
+        ORDER BY first_scanned
+    ''', (session_id,)).fetchall()
+    return [{
+        "barcode": product['barcode'],
+        "name": product['product_name'],
+        "category": product['category'],
+        "normalized_name": product['normalized_name'],
+        "normalized_category": product['normalized_category'],
+        "tokens": set(product['tokens'].split()) if product['tokens'] is not None else None
+    } for product in products]
+
 def get_session_products(session_id):
-    conn = sqlite3.connect('backend/products.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT product_name, category FROM scanned_products WHERE session_id = ?', (session_id,))
-    products = c.fetchall()
-    conn.close()
-    
-    return [{"name": product['product_name'], "category": product['category']} for product in products]
-
-# Add this set at the top of the recipe matching functions section
-INGREDIENT_ADJECTIVES = {
-    'fresh', 'dried', 'frozen', 'canned', 'organic', 'chopped', 'minced',
-    'grated', 'sliced', 'ground', 'roasted', 'raw', 'cooked', 'smoked',
-    'sweet', 'sour', 'spicy', 'boneless', 'skinless', 'whole', 'low-fat',
-    'non-fat', 'extra-virgin', 'cold-pressed', 'pure', 'natural', 'artificial',
-    'light', 'dark', 'powdered', 'crushed', 'peeled', 'seeded', 'diced',
-    'shredded', 'cubed', 'marinated', 'pickled', 'aged', 'unsalted', 'salted',
-    'sweetened', 'unsweetened', 'flavored', 'unflavored', 'premium', 'homemade',
-    'store-bought', 'crispy', 'soft', 'hard', 'mild', 'hot', 'ripe', 'unripe',
-    'bitter', 'creamy', 'crunchy', 'juicy', 'lean', 'fatty', 'thick', 'thin',
-    'liquid', 'dry', 'moist', 'tender', 'tough', 'wild', 'cultivated', 'pasteurized',
-    'unpasteurized', 'gluten-free', 'vegan', 'vegetarian', 'kosher', 'halal'
-}
-
-def check_product_matches_ingredient(product, ingredient):
-    # Normalize and remove adjectives
-    ingredient = ingredient.lower().strip()
-    ingredient_words = re.findall(r'\b\w+\b', ingredient)
-    base_ingredient = ' '.join([word for word in ingredient_words 
-                              if word not in INGREDIENT_ADJECTIVES])
-    
-    if not base_ingredient:
-        return False
-    
-    product_name = product["name"].lower()
-    product_category = product["category"].lower() if product["category"] else ""
-
-    # Check base matches
-    if (base_ingredient in product_name or 
-        product_name in base_ingredient or
-        base_ingredient in product_category):
-        return True
-    
-    # Check word components
-    base_words = set(re.findall(r'\b\w+\b', base_ingredient))
-    product_words = set(re.findall(r'\b\w+\b', f"{product_name} {product_category}"))
-    
-    # Require at least 3-letter matches to avoid short word false positives
-    meaningful_matches = [word for word in base_words 
-                        if word in product_words and len(word) > 2]
-    
-    return len(meaningful_matches) > 0
+    with products_db.connection() as conn:
+        return read_session_products(conn, session_id)
 
-def process_instructions_with_qwen(raw_instructions, recipe_title):
-    """
-    Uses the locally running Qwen model via Ollama to refine recipe instructions.
+def session_version(conn, session_id):
+    # Changes with every save to the session, whichever process made it
+    return tuple(conn.execute('''
+        SELECT COUNT(*), MAX(last_scanned) FROM session_inventory WHERE session_id = ?
+    ''', (session_id,)).fetchone())
+
+def get_session_version(session_id):
+    with products_db.connection() as conn:
+        return session_version(conn, session_id)
 
-    :param raw_instructions: The unstructured recipe instructions from the database.
-    :param recipe_title: The title of the recipe for context.
-    :return: A cleaned, structured, and numbered list of steps.
+# Match counts of recent sessions, rebuilt from session_inventory when not in memory
+# or when another process saved products to the session since
+session_matches = SessionMatchCache(recipe_index, get_session_products, get_session_version,
+                                    max_sessions=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+
+def get_recipes(recipe_ids):
+    # Title and unprocessed instructions by recipe id
+    if not recipe_ids:
+        return {}
+    placeholders = ', '.join('?' for _ in recipe_ids)
+    with metrics.span('recipe_fetch'), recipes_db.connection() as conn:
+        rows = conn.execute(f'SELECT id, Title, Instructions FROM recipes WHERE id IN ({placeholders})',
+                            list(recipe_ids)).fetchall()
+    return {row['id']: (row['Title'], row['Instructions']) for row in rows}
+
+# LLM formatted instructions, cached per recipe and pre-formatted for the next best matches
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 20))
+LLM_PREFETCH = int(os.environ.get('LLM_PREFETCH', 8))
+instruction_cache = InstructionCache('backend/instructions_cache.db', shared=shared_cache)
+instruction_formatter = InstructionFormatter(instruction_cache, get_recipes, timeout=LLM_TIMEOUT)
+# Recipe thumbnails, resolved once per recipe and prefetched in the background. The
+# server processes of a host share one prefetch through a lock file; with several
+# hosts leave THUMBNAIL_PREFETCH=1 on one of them only, or set it to 0 everywhere and
+# run python backend/thumbnails.py as a job.
+THUMBNAIL_PREFETCH = os.environ.get('THUMBNAIL_PREFETCH', '1') == '1'
+thumbnail_store = ThumbnailStore('backend/thumbnails.db', shared=shared_cache)
+
+# Runs the per-match LLM streams and image lookups of /generate_recipe/stream
+stream_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='stream')
+
+# Match log: records are queued and written to rotated, compressed NDJSON segments in
+# the background, read them back with backend/match_log.py
+match_log = MatchLog(
+    'backend/logs',
+    segment_bytes=int(os.environ.get('MATCH_LOG_SEGMENT_MB', 64)) * 1024 * 1024,
+    flush_interval=float(os.environ.get('MATCH_LOG_FLUSH_INTERVAL', 1.0)),
+    queue_size=int(os.environ.get('MATCH_LOG_QUEUE_SIZE', 10000)),
+)
+
+def log_matches(session_id, matches):
+    """Queue the matches for the log, returns their "<segment>:<offset>" location ("dropped" if the log is full)."""
+    with metrics.span('log_write'):
+        return match_log.append(session_id, matches)
+
+def decode_image(image_data, session_id):
+    with metrics.span('decode'):
+        return scan_cache.scan(image_data, scan_barcodes, session_id)
+
+# Post-scan enrichment: /scan with background=1 answers as soon as the barcodes are
+# decoded, product lookups, category classification and pre-ranking then run as
+# durable jobs (polled at /jobs/<scan_id>). The per-upstream limits are how many calls
+# the workers of one process make to OpenFoodFacts, Ollama and Bing at once, with
+# several server processes sharing jobs.db each of them gets that many.
+job_queue = JobQueue(
+    'backend/jobs.db',
+    workers=int(os.environ.get('JOB_WORKERS', 4)),
+    upstream_limits={
+        'openfoodfacts': int(os.environ.get('JOB_OPENFOODFACTS_CONCURRENCY', SCAN_LOOKUP_CONCURRENCY)),
+        'ollama': int(os.environ.get('JOB_OLLAMA_CONCURRENCY', 1)),
+        'bing': int(os.environ.get('JOB_BING_CONCURRENCY', 2)),
+    },
+    max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 5)),
+)
+
+def resolve_product_job(payload):
+    """Look up one decoded barcode and add it to the session, then queue the session's pre-ranking."""
+    barcode_data, session_id = payload['barcode'], payload['session_id']
+    with metrics.span('product_lookup'):
+        product_info = local_products.lookup(barcode_data)
+        if product_info:
+            metrics.tag('local')
+        else:
+            # Raises when OpenFoodFacts can't be reached, the job is retried
+            product_info = product_cache.get(barcode_data, raise_errors=True)
+    if not product_info:
+        return {"file": payload['file'], "error": "Product not found in database"}
+    product_info = dict(product_info)
+    save_products_to_db([product_info], session_id)
+    # Delayed a little so the products of one upload are ranked once
+    job_queue.enqueue('prerank', {"session_id": session_id}, key=f"prerank:{session_id}", delay=1.0)
+    return product_info
+
+def prerank_job(payload):
+    """Rank the session and queue instructions and thumbnails of its first page, /generate_recipe then finds them cached."""
+    options = RankingOptions()
+    index, top = rank_session(payload['session_id'], options, options.k)
+    recipe_ids = []
+    for position, _, _ in top:
+        recipe_id = index.recipe_ids[position]
+        recipe_ids.append(recipe_id)
+        job_queue.enqueue('format_instructions', {"recipe_id": recipe_id}, key=f"instructions:{recipe_id}")
+        job_queue.enqueue('resolve_thumbnail', {"recipe_id": recipe_id, "title": index.titles[position]},
+                          key=f"thumbnail:{recipe_id}")
+    return recipe_ids
+
+def format_instructions_job(payload):
+    recipe_id = payload['recipe_id']
+    if instruction_cache.get_many([recipe_id]):
+        return None
+    recipes = get_recipes([recipe_id])
+    if recipe_id not in recipes:
+        raise JobFailed(f"Recipe {recipe_id} not found")
+    title, raw_instructions = recipes[recipe_id]
+
+    def format_and_store():
+        instructions = process_instructions_with_qwen(raw_instructions, title)
+        instruction_cache.put(recipe_id, instructions)
+        return instructions
+
+    with metrics.span('llm'):
+        instruction_cache.coalesce(recipe_id, format_and_store)
+    return None
+
+def resolve_thumbnail_job(payload):
+    recipe_id = payload['recipe_id']
+    found, image_url = thumbnail_store.lookup(recipe_id)
+    if not found:
+        # Unlike resolve(), a Bing error is raised so the job is retried
+        with metrics.span('image_lookup'):
+            image_url = thumbnail_store.search(recipe_id, payload['title'])
+    return image_url
+
+job_queue.register('resolve_product', resolve_product_job, upstream='openfoodfacts')
+job_queue.register('prerank', prerank_job)
+job_queue.register('format_instructions', format_instructions_job, upstream='ollama')
+job_queue.register('resolve_thumbnail', resolve_thumbnail_job, upstream='bing')
+
+def queue_scan(session_id, decoded, errors):
     """
-    prompt = f"""
-    You are a helpful cooking assistant in a food app. 
-    Format these instructions for "{recipe_title}" into a clear, numbered step-by-step guide.
-    Keep it concise and easy to follow. Start directly with the numbered steps.
-    Do not include any introductory text, disclaimers, or phrases like "Here's the recipe" or "Here are the steps".
-    Just provide the numbered steps, formatted for mobile app display.
-
-    Raw instructions:
-    {raw_instructions}
+    Queue the lookups of one upload's barcodes, decoded: [(filename, barcodes)] in upload
+    order. Returns the 202 body of /scan, errors are the decode failures so far.
     """
+    scan_id = uuid.uuid4().hex
+    for filename, image_barcodes in decoded:
+        for barcode_data in image_barcodes:
+            job_queue.enqueue('resolve_product', {"barcode": barcode_data, "session_id": session_id, "file": filename},
+                              group=scan_id)
+    return {
+        "message": "Processing images in background",
+        "scan_id": scan_id,
+        "status_url": f"/jobs/{scan_id}",
+        "errors": errors
+    }
 
-    response = requests.post(
-        "http://localhost:11434/api/generate",
-        json={"model": "qwen2.5", "prompt": prompt, "stream": False}  # Disable streaming
-    )
+# Request timings: every endpoint goes into backend_request_seconds, and with
+# SERVER_TIMING=1 responses carry a Server-Timing header with their stages
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
 
-    try:
-        response_json = response.json()  # Convert response to JSON
-        response_text = response_json.get("response", "Error processing instructions.")
-        
-        # Remove any common prefixes that the LLM might still add
-        response_text = re.sub(r'^(Sure!|Here is|Here are|These are|Following are|Step-by-step guide:?)\s*', '', response_text, flags=re.IGNORECASE).strip()
-        
-        return response_text
-    except requests.exceptions.JSONDecodeError as e:
-        return f"JSON parsing error: {e}, Response content: {response.text}"
-
-# Save matches to a file
-def save_matches_to_file(session_id, matches):
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"backend/logs/recipe_matches_{session_id}_{timestamp}.json"
-    
-    with open(filename, 'w') as f:
-        json.dump(matches, f, indent=2)
-    
-    return filename
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+def record_request_time(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    timing = metrics.finish_request(endpoint, response.status_code, time.perf_counter() - g.request_started)
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = timing
+    return response
 
 # API Endpoints
 @app.route('/scan', methods=['POST'])
@@ -212,41 +483,70 @@ def scan_and_process():
         return jsonify({"error": "No session ID provided"}), 400
         
     images = request.files.getlist('images')
-    products = []
-    errors = []
+    # background=1: answer once the barcodes are decoded, see queue_scan. Without job
+    # workers in this process (main:app imported by another server) nothing would run
+    # the queued lookups, the scan is then answered synchronously.
+    background = request.form.get('background') == '1' and job_queue.running
 
-    # Create temporary directory
-    temp_dir = 'temp_images'
-    os.makedirs(temp_dir, exist_ok=True)
-
-    for image in images:
+    # Per-file outcomes, reported in upload order whatever order the stages finish in
+    results = [[] for _ in images]
+    image_data = {}
+    for i, image in enumerate(images):
         if image.filename == '':
-            errors.append({"file": "No file selected", "error": "Empty filename"})
+            results[i].append({"file": "No file selected", "error": "Empty filename"})
             continue
-            
-        image_path = os.path.join(temp_dir, image.filename)
-        image.save(image_path)
-    
-        try:
-            barcode_data, message = scan_barcode(image_path)
-            if not barcode_data:
-                errors.append({"file": image.filename, "error": message})
+        # Decoded from memory, uploads never touch the disk
+        with metrics.span('upload_read'):
+            image_data[i] = image.read()
+
+    # Stage 1: decode all images in parallel, stage 2 starts lookups as soon as an image is decoded
+    decode_futures = {decode_pool.submit(metrics.bind(decode_image), data, session_id): i for i, data in image_data.items()}
+    lookups = {}
+    barcodes = {}
+    for future in as_completed(decode_futures):
+        i = decode_futures[future]
+        image_barcodes, message = future.result()
+        if not image_barcodes:
+            results[i].append({"file": images[i].filename, "error": message})
+            continue
+        # A photo may hold several products
+        barcodes[i] = image_barcodes
+        if background:
+            continue
+        for barcode_data in image_barcodes:
+            # Same product photographed twice is only looked up once
+            if barcode_data not in lookups:
+                lookups[barcode_data] = lookup_pool.submit(metrics.bind(get_product_info), barcode_data)
+
+    if background and barcodes:
+        errors = [result for file_results in results for result in file_results]
+        return jsonify(queue_scan(session_id, [(images[i].filename, barcodes[i]) for i in sorted(barcodes)],
+                                  errors)), 202
+
+    found = []
+    for i in sorted(barcodes):
+        for barcode_data in barcodes[i]:
+            try:
+                product_info = lookups[barcode_data].result()
+            except Exception as e:
+                results[i].append({"file": images[i].filename, "error": f"Error processing image: {str(e)}"})
                 continue
-                
-            product_info = get_product_info(barcode_data)
             if not product_info:
-                errors.append({"file": image.filename, "error": "Product not found in database"})
+                results[i].append({"file": images[i].filename, "error": "Product not found in database"})
                 continue
-                
-            save_product_to_db(product_info, session_id)
-            products.append(product_info)
-            
+            results[i].append(dict(product_info))
+            found.append((i, len(results[i]) - 1))
+
+    # Stage 3: one transaction for the whole upload
+    if found:
+        try:
+            save_products_to_db([results[i][j] for i, j in found], session_id)
         except Exception as e:
-            errors.append({"file": image.filename, "error": f"Error processing image: {str(e)}"})
-            
-        finally:
-            if os.path.exists(image_path):
-                os.remove(image_path)
+            for i, j in found:
+                results[i][j] = {"file": images[i].filename, "error": f"Error processing image: {str(e)}"}
+
+    products = [result for file_results in results for result in file_results if "error" not in result]
+    errors = [result for file_results in results for result in file_results if "error" in result]
 
     if not products and not errors:
         return jsonify({"error": "No valid products processed"}), 400
@@ -257,6 +557,146 @@ def scan_and_process():
         "errors": errors
     })
 
+@app.route('/jobs/<scan_id>', methods=['GET'])
+def scan_status(scan_id):
+    """Progress of a background /scan: the products and lookup errors so far, in the /scan response shape."""
+    jobs = job_queue.status(scan_id)
+    if not jobs:
+        return jsonify({"error": "Unknown scan ID"}), 404
+
+    products, errors, pending = [], [], 0
+    for job in jobs:
+        if job['status'] == 'done':
+            (errors if "error" in job['result'] else products).append(job['result'])
+        elif job['status'] == 'failed':
+            errors.append({"file": job['payload']['file'], "error": f"Error processing image: {job['error']}"})
+        else:
+            pending += 1
+
+    return jsonify({
+        "status": "pending" if pending else "done",
+        "pending": pending,
+        "products": products,
+        "errors": errors
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(
+        metrics.render_counters('backend_product_cache_total', 'Product cache lookups by outcome', 'result',
+                                product_cache.stats),
+        metrics.render_counters('backend_scan_cache_total', 'Decoded image cache lookups by outcome', 'result',
+                                scan_cache.stats),
+        metrics.render_counters('backend_match_log_total', 'Match log records by outcome', 'result',
+                                match_log.stats),
+        metrics.render_counters('backend_shared_cache_total', 'Shared cache lookups and fills by outcome', 'result',
+                                shared_cache.stats),
+        metrics.render_counters('backend_jobs_total', 'Background jobs by outcome', 'result', job_queue.stats),
+    ), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"product_cache": product_cache.stats, "scan_cache": scan_cache.stats,
+                    "shared_cache": shared_cache.stats})
+
+def match_entry(index, position, matching_ingredients, match_percentage):
+    return {
+        'recipe_id': index.recipe_ids[position],
+        'title': index.titles[position],
+        'instructions': None,  # Filled in for the returned matches only
+        'matching_ingredients': matching_ingredients,
+        'total_ingredients': index.total_ingredients[position],
+        'match_percentage': match_percentage,
+    }
+
+def score_session(session_id):
+    """
+    (index, scored, presorted): scored is [(position, matching_ingredients, match_percentage)]
+    for every recipe sharing an ingredient with the session, presorted whether it is
+    already in percentage order.
+    """
+    if SCORING_ENGINE == 'session':
+        # Counts are already up to date and the ranking is kept until the next scan
+        with metrics.span('scoring'):
+            index, ranked = session_matches.ranked(session_id)
+            return index, ranked, True
+    with metrics.span('session_read'):
+        products = get_session_products(session_id)
+    with metrics.span('scoring'):
+        index, scored = score_products(products)
+        return index, scored, False
+
+def score_products(products):
+    # Count matching ingredients through the index, only candidate recipes are touched
+    index = recipe_index.get()
+    totals = index.total_ingredients
+    return index, [(position, matching_ingredients, round((matching_ingredients / totals[position]) * 100, 2))
+                   for position, matching_ingredients in index.match_counts(products).items()]
+
+def rank_session(session_id, options, count):
+    """(index, the session's best `count` [(position, matching_ingredients, match_percentage)] under options)."""
+    if SCORING_ENGINE == 'matrix':
+        # Selected inside NumPy, only the returned matches become Python tuples
+        with metrics.span('session_read'):
+            products = get_session_products(session_id)
+        with metrics.span('scoring'):
+            index, matrix = recipe_matrix.get()
+            counts = matrix.match_counts(index.session_bases(products))
+        with metrics.span('ranking'):
+            return index, matrix.top_matches(counts, options, count)
+
+    index, scored, presorted = score_session(session_id)
+    with metrics.span('ranking'):
+        return index, top_matches(scored, options, count, presorted)
+
+# Ranked pages behind the next_cursor of /generate_recipe pages, a cursor keeps this
+# many pages after its own before the next ones are rescored
+RANKING_CURSOR_PAGES = int(os.environ.get('RANKING_CURSOR_PAGES', 5))
+ranking_cursors = RankingCursors()
+
+def rank_page(session_id, data):
+    """
+    The page of matches a /generate_recipe body asks for, either k, offset, min_percent
+    and weights or the cursor of an earlier page. Returns (matches, recipe ids of the
+    runners-up to prefetch, cursor of the next page or None). Raises ValueError on
+    invalid paging parameters.
+    """
+    if data.get('cursor'):
+        cursor_id, cursor_session, offset, options = decode_cursor(data['cursor'])
+        if cursor_session != session_id:
+            raise ValueError("Cursor belongs to another session")
+        options = RankingOptions.from_request(options)
+        cursor = ranking_cursors.get(cursor_id)
+    else:
+        options = RankingOptions.from_request(data)
+        offset = request_offset(data)
+        cursor = None
+    end = offset + options.k
+    # One past the page is enough to tell whether there is a next one
+    needed = end + max(1, LLM_PREFETCH)
+
+    if cursor is not None and offset >= cursor[0] and (cursor[2] or cursor[0] + len(cursor[1]) >= needed):
+        start, ranked, _ = cursor
+    else:
+        limit = needed + options.k * RANKING_CURSOR_PAGES
+        index, top = rank_session(session_id, options, limit)
+        # Only what this page and the cursor's next pages need, the full scored list isn't kept
+        start, ranked = offset, [match_entry(index, *match) for match in top[offset:]]
+        cursor_id = ranking_cursors.put(start, ranked, len(top) < limit) if len(top) > end else None
+
+    next_cursor = None
+    if start + len(ranked) > end:
+        next_cursor = encode_cursor({"id": cursor_id, "session_id": session_id, "offset": end,
+                                     "options": options.to_dict()})
+    return ([dict(match) for match in ranked[offset - start:end - start]],
+            [match['recipe_id'] for match in ranked[end - start:end - start + LLM_PREFETCH]],
+            next_cursor)
+
+def resolve_image_url(match):
+    # Usually a table lookup, Bing is only asked for recipes the prefetcher hasn't reached
+    with metrics.span('image_lookup'):
+        return thumbnail_store.resolve(match['recipe_id'], match['title'])
+
 @app.route('/generate_recipe', methods=['POST'])
 def generate_recipe():
     data = request.get_json()
@@ -265,95 +705,125 @@ def generate_recipe():
     if not session_id:
         return jsonify({"error": "No session ID provided"}), 400
         
-    products = get_session_products(session_id)
-    
-    # Connect to recipe database
-    recipe_conn = sqlite3.connect('backend/recipes.db')
-    recipe_conn.row_factory = sqlite3.Row
-    cursor = recipe_conn.cursor()
-    
+    # First pass: rank candidate recipes without processing instructions, only the page is kept
     try:
-        cursor.execute('SELECT * FROM recipes')
-        recipes = cursor.fetchall()
-        
-        # First pass: calculate matches and percentages without processing instructions
-        matches = []
-        for recipe in recipes:
-            # Parse recipe ingredients
-            recipe_ingredients = []
-            if 'Ingredients' in recipe.keys():
-                ingredients_text = recipe['Ingredients']
-                if ingredients_text:
-                    recipe_ingredients = [ing.strip() for ing in ingredients_text.split(',')]
-            
-            # Check if any product matches any ingredient
-            matching_ingredients = 0
-            for ingredient in recipe_ingredients:
-                for product in products:
-                    if check_product_matches_ingredient(product, ingredient):
-                        matching_ingredients += 1
-                        break  # Move to next ingredient once a match is found
-            
-            # Calculate match percentage
-            match_percentage = 0
-            if recipe_ingredients:
-                match_percentage = (matching_ingredients / len(recipe_ingredients)) * 100
-
-            #Add thumbnail image URL 
-            def get_first_image_url(query):
-                query = query.replace(" ", "+")
-                bing_search_url = f"https://www.bing.com/images/search?q={query}+filterui:imagesize-large"
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-                response = requests.get(bing_search_url, headers=headers)
-                soup = BeautifulSoup(response.content, 'html.parser')
-                image_tags = soup.find_all('img', {'class': 'mimg'})
-                for img in image_tags[1:]:
-                    img_url = img.get('data-src') or img.get('src')
-                    if img_url and img_url.startswith('http'):
-                        return img_url
-                return None
-            
-            # Only include recipes with at least one matching ingredient
-            if matching_ingredients > 0:
-                matches.append({
-                    'recipe_id': recipe['id'],
-                    'title': recipe['Title'],
-                    'instructions': recipe['Instructions'],  # Original unprocessed instructions
-                    'matching_ingredients': matching_ingredients,
-                    'total_ingredients': len(recipe_ingredients),
-                    'match_percentage': round(match_percentage, 2),
-                })
-        
-        # Sort matches by match percentage in descending order
-        matches = sorted(matches, key=lambda x: x['match_percentage'], reverse=True)[:2]
-
-        # Second pass: process instructions only for top 2 matches
-        for i in range(min(2, len(matches))):
-            matches[i]['instructions'] = process_instructions_with_qwen(
-                matches[i]['instructions'], 
-                matches[i]['title']
-            )
-            query = matches[i]['title']
-            image_url = get_first_image_url(query)
-            if image_url:
-                image_url = image_url.split('?')[0]
-                print("First image URL:", image_url)
-                matches[i]['imageURL'] = image_url
-            else:
-                print("No images found.")
-        
-        # Save matches to file
-        log_file = save_matches_to_file(session_id, matches)
-        
-        print(f"Saved {len(matches)} matches to {log_file}")
-        return jsonify({
-            "matches": matches,
-            "log_file": log_file
-        })
-        
-    finally:
-        recipe_conn.close()
+        matches, runners_up, next_cursor = rank_page(session_id, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Format the runners-up in the background so they are cached if asked for later
+    instruction_formatter.prefetch(runners_up)
+
+    # Second pass: process instructions only for the page, the LLM calls run concurrently
+    recipes = get_recipes([match['recipe_id'] for match in matches])
+    with metrics.span('llm'):
+        formatted = instruction_formatter.format_many([
+            (match['recipe_id'], match['title'], recipes.get(match['recipe_id'], (None, None))[1])
+            for match in matches
+        ])
+    for match, instructions in zip(matches, formatted):
+        match['instructions'] = instructions
+        image_url = resolve_image_url(match)
+        if image_url:
+            match['imageURL'] = image_url
+
+    # Queue the matches for the match log
+    log_file = log_matches(session_id, matches)
+
+    print(f"Logged {len(matches)} matches at {log_file}")
+    return jsonify({
+        "matches": matches,
+        "log_file": log_file,
+        "next_cursor": next_cursor
+    })
+
+@app.route('/generate_recipe/stream', methods=['POST'])
+def generate_recipe_stream():
+    """
+    Streaming variant of /generate_recipe, same paging parameters. Sends newline
+    delimited JSON events (or server-sent events when the client accepts text/event-stream):
+
+      {"event": "matches", "matches": [...], "next_cursor": ..}  ranked matches, no instructions yet
+      {"event": "instructions_delta", "recipe_id": .., "text": ..} LLM output as it is generated
+      {"event": "instructions", "recipe_id": .., "instructions": ..}
+      {"event": "image", "recipe_id": .., "imageURL": ..}
+      {"event": "done", "log_file": ..}
+    """
+    data = request.get_json()
+    session_id = data.get('session_id')
+
+    if not session_id:
+        return jsonify({"error": "No session ID provided"}), 400
+
+    try:
+        matches, runners_up, next_cursor = rank_page(session_id, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    instruction_formatter.prefetch(runners_up)
+
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+
+    def encode(event):
+        line = json.dumps(event)
+        return f"data: {line}\n\n" if sse else line + "\n"
+
+    def stream_instructions(match, raw_instructions, events):
+        with metrics.span('llm'):
+            for kind, text in instruction_formatter.stream(match['recipe_id'], match['title'], raw_instructions):
+                if kind == "delta":
+                    events.put({"event": "instructions_delta", "recipe_id": match['recipe_id'], "text": text})
+                else:
+                    match['instructions'] = text
+                    events.put({"event": "instructions", "recipe_id": match['recipe_id'], "instructions": text})
+
+    def stream_image(match, events):
+        image_url = resolve_image_url(match)
+        if image_url:
+            match['imageURL'] = image_url
+        events.put({"event": "image", "recipe_id": match['recipe_id'], "imageURL": image_url})
+
+    def generate():
+        yield encode({"event": "matches", "matches": [
+            {key: value for key, value in match.items() if key != 'instructions'} for match in matches
+        ], "next_cursor": next_cursor})
+
+        recipes = get_recipes([match['recipe_id'] for match in matches])
+        events = queue.Queue()
+        tasks = []
+        for match in matches:
+            raw_instructions = recipes.get(match['recipe_id'], (None, None))[1]
+            tasks.append(stream_pool.submit(metrics.bind(stream_instructions), match, raw_instructions, events))
+            tasks.append(stream_pool.submit(metrics.bind(stream_image), match, events))
+
+        # Forward events as they arrive until every task has finished
+        while True:
+            try:
+                yield encode(events.get(timeout=0.1))
+            except queue.Empty:
+                if all(task.done() for task in tasks):
+                    break
+        while not events.empty():
+            yield encode(events.get_nowait())
+        for task in tasks:
+            if task.exception():
+                print(f"Streaming task failed: {task.exception()}")
+
+        log_file = log_matches(session_id, matches)
+        yield encode({"event": "done", "log_file": log_file})
+
+    return Response(stream_with_context(generate()),
+                    mimetype='text/event-stream' if sse else 'application/x-ndjson')
+
+def start_background_jobs():
+    start_retention_job(products_db, 'backend/products_archive.db', SESSION_RETENTION_DAYS)
+    if THUMBNAIL_PREFETCH:
+        thumbnail_store.start_prefetch('backend/recipes.db', lock_path='backend/thumbnail_prefetch.lock')
+    job_queue.start()
 
 if __name__ == "__main__":
     init_db()
+    # The debug reloader runs this module again in the child process that serves
+    # requests, only that one runs the background jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_jobs()
     app.run(port=8000, debug=True)
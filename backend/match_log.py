@@ -0,0 +1,199 @@
+# Match log: every /generate_recipe answer, appended by a background writer to
+# gzip-compressed NDJSON segments under backend/logs. Requests only queue the
+# record, the writer flushes the queue every flush_interval seconds as one gzip
+# member per segment, and segments are rotated by size and age.
+#
+# A record's location is "<segment path>:<offset>", the offset counted in the
+# uncompressed stream. To read the log back:
+#   python backend/match_log.py backend/logs --session <id>
+#   python backend/match_log.py backend/logs --top 20
+#   python backend/match_log.py --entry backend/logs/matches_..._0.ndjson.gz:5120
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+
+SEGMENT_PATTERN = 'matches_*.ndjson.gz'
+
+class MatchLog:
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, segment_seconds=3600,
+                 flush_interval=1.0, queue_size=10000):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._segment = None
+        self._segment_size = 0  # uncompressed bytes handed to the writer
+        self._segment_started = 0
+        self._segments_opened = 0
+        self._worker = None
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "write_errors": 0}
+
+    def _new_segment(self, now):
+        # The pid keeps workers of one deployment out of each other's segments
+        name = f"matches_{datetime.fromtimestamp(now).strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{self._segments_opened}.ndjson.gz"
+        self._segments_opened += 1
+        self._segment = os.path.join(self.directory, name)
+        self._segment_size = 0
+        self._segment_started = now
+
+    def append(self, session_id, matches):
+        """
+        Queue one record and return where it will be, "<segment>:<offset>". Returns
+        "dropped" when the queue is full: the record is dropped rather than slowing the
+        request down, and clients still get a string for log_file.
+        """
+        now = time.time()
+        line = (json.dumps({"session_id": session_id, "logged_at": datetime.fromtimestamp(now).isoformat(),
+                            "matches": matches}) + '\n').encode('utf-8')
+        with self._lock:
+            if self._worker is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._worker = threading.Thread(target=self._write_loop, name='match-log', daemon=True)
+                self._worker.start()
+                atexit.register(self.close)
+            if (self._segment is None or now - self._segment_started >= self.segment_seconds
+                    or (self._segment_size and self._segment_size + len(line) > self.segment_bytes)):
+                self._new_segment(now)
+            # Offsets are handed out in queue order, which is the order the writer appends in
+            try:
+                self._queue.put_nowait((self._segment, line))
+            except queue.Full:
+                self.stats["dropped"] += 1
+                return "dropped"
+            location = f"{self._segment}:{self._segment_size}"
+            self._segment_size += len(line)
+            self.stats["queued"] += 1
+        return location
+
+    def flush(self):
+        """Block until everything queued so far is on disk."""
+        if self._worker is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None and worker.is_alive():
+            self._queue.put(None)
+            worker.join()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+            # Collect until the flush is due, someone asks for it or the log is closed
+            while isinstance(item, tuple):
+                batch.append(item)
+                if time.monotonic() >= deadline:
+                    item = False
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = False
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+            if item is None:
+                return
+
+    def _write(self, batch):
+        # One gzip member per segment per flush, a reader sees them as one stream
+        start = 0
+        while start < len(batch):
+            segment = batch[start][0]
+            end = start
+            while end < len(batch) and batch[end][0] == segment:
+                end += 1
+            try:
+                with open(segment, 'ab') as f:
+                    f.write(gzip.compress(b''.join(line for _, line in batch[start:end])))
+                with self._lock:
+                    self.stats["written"] += end - start
+            except Exception as e:
+                print(f"Error writing match log {segment}: {str(e)}")
+                with self._lock:
+                    self.stats["write_errors"] += end - start
+            start = end
+
+def read_segment(path):
+    """Yields (offset, record) for every record in one segment."""
+    offset = 0
+    with gzip.open(path, 'rb') as f:
+        try:
+            for line in f:
+                yield offset, json.loads(line)
+                offset += len(line)
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            # The last member of a segment cut short by a crash
+            print(f"Truncated match log segment {path} after offset {offset}", file=sys.stderr)
+
+def segments(directory):
+    """Segment paths, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN)), key=os.path.getmtime)
+
+def read_entry(location):
+    """The record at a "<segment>:<offset>" location as returned by MatchLog.append."""
+    path, offset = location.rsplit(':', 1)
+    with gzip.open(path, 'rb') as f:
+        f.seek(int(offset))
+        return json.loads(f.readline())
+
+def read_log(directory, session_id=None, since=None):
+    """Every record in the log directory, optionally one session's or logged after `since` (ISO time)."""
+    for path in segments(directory):
+        for _, record in read_segment(path):
+            if session_id is not None and record["session_id"] != session_id:
+                continue
+            if since is not None and record["logged_at"] < since:
+                continue
+            yield record
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the recipe match log")
+    parser.add_argument('directory', nargs='?', default='backend/logs')
+    parser.add_argument('--entry', help="print the record at <segment>:<offset>")
+    parser.add_argument('--session', help="only this session's records")
+    parser.add_argument('--since', help="only records logged at or after this ISO time")
+    parser.add_argument('--top', type=int, help="print the N most often matched recipes instead of records")
+    args = parser.parse_args()
+
+    if args.entry:
+        print(json.dumps(read_entry(args.entry), indent=2))
+        sys.exit()
+
+    records = read_log(args.directory, args.session, args.since)
+    if args.top:
+        counts = Counter()
+        titles = {}
+        total = 0
+        for record in records:
+            total += 1
+            for match in record["matches"]:
+                counts[match["recipe_id"]] += 1
+                titles[match["recipe_id"]] = match["title"]
+        print(f"{total} requests")
+        for recipe_id, count in counts.most_common(args.top):
+            print(f"{count:>8}  {recipe_id:>8}  {titles[recipe_id]}")
+    else:
+        for record in records:
+            print(json.dumps(record))
@@ -0,0 +1,123 @@
+# Stage timings for the request paths, exported as Prometheus histograms.
+#
+#   with metrics.span('decode'):
+#       ...
+#       metrics.tag(cache='hit')   # label the innermost open span
+#
+# Every span lands in the backend_stage_seconds{stage, cache} histogram. Spans opened while
+# a request is being handled are also collected for its Server-Timing header.
+# Work handed to a thread pool keeps the request's spans when the callable is
+# wrapped with metrics.bind(fn).
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from a memory-cache hit to a slow LLM call
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the Prometheus text format."""
+
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        position = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[position] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {values[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines)
+
+stage_seconds = Histogram('backend_stage_seconds', 'Time spent in each request stage', ('stage', 'cache'))
+request_seconds = Histogram('backend_request_seconds', 'End to end request time', ('endpoint', 'status'))
+
+class Span:
+    __slots__ = ('stage', 'cache')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.cache = ''
+
+# Innermost open span, and the current request's finished spans (stage, cache, seconds)
+_current_span = contextvars.ContextVar('current_span', default=None)
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+@contextmanager
+def span(stage):
+    current = Span(stage)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_span.reset(token)
+        stage_seconds.observe(elapsed, current.stage, current.cache)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((current.stage, current.cache, elapsed))
+
+def tag(cache):
+    """Label the innermost open span with a cache outcome (e.g. "hit", "miss")."""
+    current = _current_span.get()
+    if current is not None:
+        current.cache = cache
+
+def bind(fn):
+    """fn run in the caller's context, so spans in a pool thread count towards the caller's request."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+def start_request():
+    _request_spans.set([])
+
+def finish_request(endpoint, status, elapsed):
+    """Record the request and return its Server-Timing header value."""
+    request_seconds.observe(elapsed, endpoint, str(status))
+    spans = _request_spans.get() or []
+    _request_spans.set(None)
+
+    # Stages that ran several times (one per image, per barcode, ...) are summed
+    totals = {}
+    for stage, cache, seconds in spans:
+        key = (stage, cache)
+        count, total = totals.get(key, (0, 0.0))
+        totals[key] = (count + 1, total + seconds)
+    entries = []
+    for (stage, cache), (count, total) in totals.items():
+        description = ' '.join(part for part in (cache, f"x{count}" if count > 1 else '') if part)
+        entries.append(f'{stage};dur={total * 1000:.1f}' + (f';desc="{description}"' if description else ''))
+    entries.append(f'total;dur={elapsed * 1000:.1f}')
+    return ', '.join(entries)
+
+def render_counters(name, help_text, label_name, counters):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    lines.extend(f'{name}{{{label_name}="{key}"}} {value}' for key, value in sorted(counters.items()))
+    return '\n'.join(lines)
+
+def render(*extra):
+    """Every metric in the Prometheus text exposition format."""
+    return '\n'.join([stage_seconds.render(), request_seconds.render(), *extra]) + '\n'
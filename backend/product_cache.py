@@ -0,0 +1,212 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from db import ConnectionPool
+
+class ProductCache:
+    """
+    Read-through cache in front of the OpenFoodFacts lookup, keyed by barcode.
+
+    Two tiers: an in-process LRU and a SQLite table that survives restarts.
+    "Product not found" answers are cached too (for a shorter time). Entries past
+    their TTL are still served while a background refresh runs, and are kept as a
+    fallback when the upstream is slow or down.
+
+    `fetch(barcode)` must return the product dict, None when the product does not
+    exist, and raise when the upstream could not be reached.
+
+    With a SharedCache, answers other instances fetched are reused before asking the
+    upstream, and concurrent misses for one barcode make a single upstream call.
+    """
+
+    def __init__(self, fetch, db_path='backend/product_cache.db', max_entries=4096,
+                 ttl=7 * 24 * 3600, negative_ttl=24 * 3600, max_stale=30 * 24 * 3600, shared=None):
+        self.fetch = fetch
+        self.db_path = db_path
+        self.db = ConnectionPool(db_path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        self.shared = shared
+
+        self._lru = OrderedDict()  # barcode -> (product or None, fetched_at)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='product-refresh')
+        self.stats = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "negative_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "upstream_errors": 0,
+        }
+
+    def init_db(self):
+        with self.db.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS product_cache (
+                    barcode TEXT PRIMARY KEY,
+                    product_name TEXT,
+                    category TEXT,
+                    found INTEGER,
+                    fetched_at REAL
+                )
+            ''')
+            conn.commit()
+
+    def _count(self, stat):
+        metrics.tag(stat)
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _remember(self, barcode, product, fetched_at):
+        with self._lock:
+            self._lru[barcode] = (product, fetched_at)
+            self._lru.move_to_end(barcode)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _load(self, barcode):
+        with self.db.connection() as conn:
+            row = conn.execute(
+                'SELECT product_name, category, found, fetched_at FROM product_cache WHERE barcode = ?',
+                (barcode,)
+            ).fetchone()
+        entry = None
+        if row is not None:
+            product_name, category, found, fetched_at = row
+            product = None
+            if found:
+                product = {"product_name": product_name, "category": category, "barcode": barcode}
+            entry = product, fetched_at
+        if self.shared is not None and (
+                entry is None or time.time() - entry[1] >= (self.ttl if entry[0] else self.negative_ttl)):
+            # Another instance may have fetched it more recently
+            shared = self.shared.get(f"product:{barcode}")
+            if shared is not None and (entry is None or shared[1] > entry[1]):
+                entry = tuple(shared)
+                self._store(barcode, *entry, publish=False)
+        return entry
+
+    def _store(self, barcode, product, fetched_at, publish=True):
+        if publish and self.shared is not None:
+            self.shared.set(f"product:{barcode}", [product, fetched_at], ttl=self.max_stale)
+        with self.db.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO product_cache (barcode, product_name, category, found, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                barcode,
+                product["product_name"] if product else None,
+                product["category"] if product else None,
+                1 if product else 0,
+                fetched_at
+            ))
+            conn.commit()
+        self._remember(barcode, product, fetched_at)
+
+    def _fetch_and_store(self, barcode):
+        def fetch_and_store():
+            product = self.fetch(barcode)
+            self._store(barcode, product, time.time())
+            return product
+
+        if self.shared is None:
+            return fetch_and_store()
+        return self.shared.coalesce(f"product:{barcode}", fetch_and_store)
+
+    def _refresh(self, barcode):
+        try:
+            self._fetch_and_store(barcode)
+        except Exception as e:
+            self._count("upstream_errors")
+            print(f"Background refresh failed for {barcode}: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(barcode)
+
+    def _schedule_refresh(self, barcode):
+        with self._lock:
+            if barcode in self._refreshing:
+                return
+            self._refreshing.add(barcode)
+        self._refresh_pool.submit(self._refresh, barcode)
+
+    def _cached(self, barcode):
+        """(entry, answered): answered is False when the upstream has to be asked, entry is then the fallback."""
+        with self._lock:
+            entry = self._lru.get(barcode)
+            if entry is not None:
+                self._lru.move_to_end(barcode)
+        stat = "memory_hits"
+        if entry is None:
+            entry = self._load(barcode)
+            stat = "db_hits"
+            if entry is not None:
+                self._remember(barcode, *entry)
+
+        if entry is not None:
+            product, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < (self.ttl if product else self.negative_ttl):
+                self._count(stat if product else "negative_hits")
+                return entry, True
+            if age < self.max_stale:
+                self._count("stale_hits")
+                self._schedule_refresh(barcode)
+                return entry, True
+        return entry, False
+
+    def _upstream_failed(self, entry, error):
+        self._count("upstream_errors")
+        print(f"Error fetching product info: {str(error)}")
+        # Anything we have, however old, beats failing the scan
+        return entry[0] if entry is not None else None
+
+    def get(self, barcode, raise_errors=False):
+        """
+        The product, None when it doesn't exist. With raise_errors an upstream error
+        that nothing cached can stand in for is raised instead of answered with None.
+        """
+        entry, answered = self._cached(barcode)
+        if answered:
+            return entry[0]
+
+        self._count("misses")
+        try:
+            return self._fetch_and_store(barcode)
+        except Exception as e:
+            if raise_errors and entry is None:
+                self._count("upstream_errors")
+                raise
+            return self._upstream_failed(entry, e)
+
+    async def get_async(self, barcode, fetch):
+        """
+        get() for the async server, the upstream is asked with the coroutine function
+        `fetch`. The SQLite reads and writes run in the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        entry, answered = await loop.run_in_executor(None, metrics.bind(self._cached), barcode)
+        if answered:
+            return entry[0]
+
+        self._count("misses")
+
+        async def fetch_and_store():
+            product = await fetch(barcode)
+            await loop.run_in_executor(None, self._store, barcode, product, time.time())
+            return product
+
+        try:
+            if self.shared is None:
+                return await fetch_and_store()
+            return await self.shared.coalesce_async(f"product:{barcode}", fetch_and_store)
+        except Exception as e:
+            return self._upstream_failed(entry, e)
@@ -0,0 +1,154 @@
+# Offline copy of the OpenFoodFacts product table, so most barcodes resolve
+# without a network round trip. Import the full export once, then apply the
+# daily delta files:
+#   python backend/product_dump.py openfoodfacts-products.jsonl.gz
+#   python backend/product_dump.py en.openfoodfacts.org.products.csv.gz
+#   python backend/product_dump.py --delta 1712345678_1712432078.json.gz
+import argparse
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from db import ConnectionPool
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace', newline='')
+    return open(path, 'r', encoding='utf-8', errors='replace', newline='')
+
+def read_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            product = json.loads(line)
+        except ValueError:
+            continue
+        yield product.get('code'), product.get('product_name'), product.get('categories'), product.get('last_modified_t')
+
+def read_csv(f):
+    # The OpenFoodFacts CSV export is tab separated and has very long fields
+    csv.field_size_limit(sys.maxsize)
+    for row in csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+        yield row.get('code'), row.get('product_name') or None, row.get('categories') or None, row.get('last_modified_t')
+
+class LocalProductTable:
+    def __init__(self, db_path='backend/openfoodfacts.db'):
+        self.db_path = db_path
+        self.db = ConnectionPool(db_path)
+
+    def init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS products (
+                barcode TEXT PRIMARY KEY,
+                product_name TEXT,
+                categories TEXT,
+                last_modified_t INTEGER
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS imports (
+                source TEXT PRIMARY KEY,
+                imported_at REAL,
+                rows INTEGER
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def lookup(self, barcode):
+        """Product dict in the shape get_product_info returns, or None if the barcode isn't in the dump."""
+        if not os.path.exists(self.db_path):
+            return None
+        try:
+            with self.db.connection() as conn:
+                row = conn.execute(
+                    'SELECT product_name, categories FROM products WHERE barcode = ?', (barcode,)
+                ).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        if row is None:
+            return None
+        return {
+            "product_name": row[0] if row[0] is not None else "Unknown Product",
+            "category": row[1] if row[1] is not None else "Unknown Category",
+            "barcode": barcode
+        }
+
+    def import_file(self, path, batch_size=10000, delta=False):
+        """
+        Stream a JSONL or CSV export into the table in batches, so memory stays
+        flat however big the file is. Rows only replace existing ones when they
+        are newer, which makes re-importing a full export an incremental update.
+        Delta files are recorded and skipped if applied again.
+        """
+        self.init_db()
+        source = os.path.basename(path)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA synchronous=OFF')
+
+        if delta and conn.execute('SELECT 1 FROM imports WHERE source = ?', (source,)).fetchone():
+            print(f"{source} already imported, skipping")
+            conn.close()
+            return 0
+
+        reader = read_csv if '.csv' in path or '.tsv' in path else read_jsonl
+        started = time.time()
+        imported = 0
+        batch = []
+        with open_text(path) as f:
+            for code, product_name, categories, last_modified_t in reader(f):
+                if not code:
+                    continue
+                try:
+                    last_modified_t = int(last_modified_t) if last_modified_t else 0
+                except ValueError:
+                    last_modified_t = 0
+                batch.append((code, product_name, categories, last_modified_t))
+                if len(batch) >= batch_size:
+                    imported += self._write_batch(conn, batch)
+                    batch = []
+                    print(f"{imported} rows imported ({time.time() - started:.0f}s)")
+        if batch:
+            imported += self._write_batch(conn, batch)
+
+        conn.execute(
+            'INSERT OR REPLACE INTO imports (source, imported_at, rows) VALUES (?, ?, ?)',
+            (source, time.time(), imported)
+        )
+        conn.commit()
+        conn.close()
+        print(f"Imported {imported} rows from {source} in {time.time() - started:.0f}s")
+        return imported
+
+    def _write_batch(self, conn, batch):
+        with conn:
+            conn.executemany('''
+                INSERT INTO products (barcode, product_name, categories, last_modified_t)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(barcode) DO UPDATE SET
+                    product_name = excluded.product_name,
+                    categories = excluded.categories,
+                    last_modified_t = excluded.last_modified_t
+                WHERE excluded.last_modified_t > products.last_modified_t
+            ''', batch)
+        return len(batch)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import an OpenFoodFacts export into the local product table")
+    parser.add_argument('files', nargs='+', help="JSONL or CSV export, optionally gzipped")
+    parser.add_argument('--db', default='backend/openfoodfacts.db')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--delta', action='store_true', help="files are delta exports, skip ones already applied")
+    args = parser.parse_args()
+
+    table = LocalProductTable(args.db)
+    for path in args.files:
+        table.import_file(path, batch_size=args.batch_size, delta=args.delta)
@@ -0,0 +1,134 @@
+import base64
+import heapq
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+DEFAULT_K = 2
+MAX_K = 50
+# Score = percentage weight x match percentage + matching_ingredients weight x matched count.
+# The defaults rank by percentage alone, the order /generate_recipe always used.
+DEFAULT_WEIGHTS = {"percentage": 1.0, "matching_ingredients": 0.0}
+
+class RankingOptions:
+    def __init__(self, k=DEFAULT_K, min_percent=0.0, weights=None):
+        self.k = k
+        self.min_percent = min_percent
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+
+    @classmethod
+    def from_request(cls, data):
+        """Options from a /generate_recipe body. Raises ValueError, with a message for the client, on bad values."""
+        k = data.get('k', DEFAULT_K)
+        if isinstance(k, bool) or not isinstance(k, int) or not 1 <= k <= MAX_K:
+            raise ValueError(f"k must be an integer from 1 to {MAX_K}")
+        min_percent = data.get('min_percent', 0)
+        if isinstance(min_percent, bool) or not isinstance(min_percent, (int, float)) or not 0 <= min_percent <= 100:
+            raise ValueError("min_percent must be a number from 0 to 100")
+        weights = data.get('weights') or {}
+        if not isinstance(weights, dict) or set(weights) - set(DEFAULT_WEIGHTS):
+            raise ValueError(f"weights may only set {', '.join(DEFAULT_WEIGHTS)}")
+        for name, weight in weights.items():
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight < 0:
+                raise ValueError(f"weight {name} must be a non-negative number")
+        options = cls(k, float(min_percent), {name: float(weight) for name, weight in weights.items()})
+        if not any(options.weights.values()):
+            raise ValueError("at least one weight must be positive")
+        return options
+
+    def to_dict(self):
+        return {"k": self.k, "min_percent": self.min_percent, "weights": self.weights}
+
+    @property
+    def percentage_order(self):
+        """Whether this ranks exactly like match percentage alone."""
+        return self.weights["matching_ingredients"] == 0
+
+    def sort_key(self):
+        by_percentage, by_count = self.weights["percentage"], self.weights["matching_ingredients"]
+        # Best score first, then higher percentage, then table order
+        return lambda match: (-(by_percentage * match[2] + by_count * match[1]), -match[2], match[0])
+
+def request_offset(data):
+    offset = data.get('offset', 0)
+    if isinstance(offset, bool) or not isinstance(offset, int) or offset < 0:
+        raise ValueError("offset must be a non-negative integer")
+    return offset
+
+def top_matches(scored, options, count=None, presorted=False):
+    """
+    The best `count` of scored [(position, matching_ingredients, match_percentage)], in
+    ranking order. A heap keeps only `count` candidates while going through the list.
+    `presorted` says scored is already in percentage order, which is enough when the
+    options rank by percentage: the answer is then a prefix of it.
+    """
+    if presorted and options.percentage_order:
+        top = []
+        for match in scored:
+            if match[2] < options.min_percent or len(top) == count:
+                break
+            top.append(match)
+        return top
+    eligible = (match for match in scored if match[2] >= options.min_percent) if options.min_percent else scored
+    if count is None:
+        return sorted(eligible, key=options.sort_key())
+    return heapq.nsmallest(count, eligible, key=options.sort_key())
+
+def encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def decode_cursor(token):
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        cursor_id, session_id, offset, options = cursor["id"], cursor["session_id"], cursor["offset"], cursor["options"]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(cursor_id, str) or not isinstance(offset, int) or offset < 0 or not isinstance(options, dict):
+        raise ValueError("Invalid cursor")
+    return cursor_id, session_id, offset, options
+
+class RankingCursors:
+    """
+    Ranked pages kept for pagination, by cursor id. A cursor pins the next few pages
+    after the one it was made for, already sorted, so they neither rescore nor shift
+    when products are scanned in between. Pages past those, and expired cursors, are
+    rescored from the options the cursor carries. Memory is bounded by the number of
+    cursors and by the matches they hold in total.
+    """
+
+    def __init__(self, max_entries=1000, max_matches=100000, ttl=600):
+        self.max_entries = max_entries
+        self.max_matches = max_matches
+        self.ttl = ttl
+        self._entries = OrderedDict()  # cursor id -> (start, ranked, complete, created)
+        self._matches = 0
+        self._lock = threading.Lock()
+
+    def put(self, start, ranked, complete):
+        """
+        Keep ranked, the matches from offset `start` on in ranking order. complete says
+        nothing ranks after them.
+        """
+        cursor_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._entries[cursor_id] = (start, ranked, complete, now)
+            self._matches += len(ranked)
+            while self._entries:
+                oldest_id, oldest = next(iter(self._entries.items()))
+                if (len(self._entries) <= self.max_entries and self._matches <= self.max_matches
+                        and now - oldest[3] < self.ttl):
+                    break
+                del self._entries[oldest_id]
+                self._matches -= len(oldest[1])
+        return cursor_id
+
+    def get(self, cursor_id):
+        """(start, ranked, complete) of a live cursor, or None."""
+        with self._lock:
+            entry = self._entries.get(cursor_id)
+        if entry is None or time.time() - entry[3] >= self.ttl:
+            return None
+        return entry[:3]
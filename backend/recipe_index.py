@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+
+from fuzzy_match import FuzzyMatcher
+from ingredients import IngredientForms, split_ingredients, normalize_product, tokenize
+from recipe_snapshot import IntColumn, RecipeSnapshot, SnapshotPostings, write_snapshot
+
+class RecipeIndex:
+    """
+    Inverted index over the recipe table.
+
+    Every recipe ingredient is reduced to its base form (see normalize_ingredient).
+    Whether an ingredient matches a product only depends on that base form, so the
+    session products are resolved to the set of matching base forms first and hits
+    are then counted through base -> recipe postings, instead of comparing every
+    ingredient of every recipe with every product.
+
+    Recipes are addressed by their position in table order so ties rank the same
+    way the old full table scan did.
+
+    match_mode "strict" accepts exactly what check_product_matches_ingredient does.
+    "fuzzy" also accepts ingredients sharing a stemmed word with the product, or a
+    word at least fuzzy_threshold similar (see FuzzyMatcher).
+    """
+
+    def __init__(self, recipe_ids, titles, total_ingredients, postings, base_tokens,
+                 match_mode='strict', fuzzy_threshold=0.6):
+        self.recipe_ids = recipe_ids                # position -> recipe id
+        self.titles = titles                        # position -> title
+        self.total_ingredients = total_ingredients  # position -> number of ingredients
+        self.postings = postings                    # base form -> [(position, occurrences)]
+
+        token_bases = defaultdict(set)
+        for base_ingredient, words in base_tokens.items():
+            for word in words:
+                if len(word) > 2:
+                    token_bases[word].add(base_ingredient)
+        self.token_bases = dict(token_bases)
+        self.base_lengths = sorted({len(base) for base in postings})
+        self.bases_by_length = sorted(postings, key=len, reverse=True)
+        self.fuzzy = FuzzyMatcher(self.token_bases, fuzzy_threshold) if match_mode == 'fuzzy' else None
+        self.snapshot = None
+
+    @classmethod
+    def from_db(cls, db_path, forms_path, **options):
+        forms = IngredientForms(forms_path)
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            recipe_ids, titles, totals = [], [], []
+            postings = defaultdict(lambda: defaultdict(int))
+            base_tokens = {}
+            for position, recipe in enumerate(conn.execute('SELECT * FROM recipes')):
+                recipe_ingredients = []
+                if 'Ingredients' in recipe.keys():
+                    recipe_ingredients = split_ingredients(recipe['Ingredients'])
+
+                recipe_ids.append(recipe['id'])
+                titles.append(recipe['Title'])
+                totals.append(len(recipe_ingredients))
+
+                for ingredient in recipe_ingredients:
+                    base_ingredient, words = forms.get(ingredient)
+                    if base_ingredient:
+                        postings[base_ingredient][position] += 1
+                        base_tokens[base_ingredient] = words
+        finally:
+            conn.close()
+        forms.save()
+
+        return cls(recipe_ids, titles, totals,
+                   {base: sorted(hits.items()) for base, hits in postings.items()},
+                   base_tokens, **options)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, **options):
+        """Index over a memory-mapped RecipeSnapshot, postings are read from the mapped arrays."""
+        index = cls(snapshot.recipe_ids, snapshot.titles, IntColumn(snapshot.totals), SnapshotPostings(snapshot),
+                    {base: tokenize(base) for base in snapshot.vocabulary}, **options)
+        index.snapshot = snapshot
+        return index
+
+    def matching_bases(self, product):
+        """All base forms that check_product_matches_ingredient would accept for this product."""
+        postings = self.postings
+        product_name, product_category, product_words = normalize_product(product)
+        matched = set()
+
+        # base_ingredient in product_name / product_category
+        for text in (product_name, product_category):
+            for length in self.base_lengths:
+                if length > len(text):
+                    break
+                for start in range(len(text) - length + 1):
+                    candidate = text[start:start + length]
+                    if candidate in postings:
+                        matched.add(candidate)
+
+        # product_name in base_ingredient
+        for base_ingredient in self.bases_by_length:
+            if len(base_ingredient) < len(product_name):
+                break
+            if product_name in base_ingredient:
+                matched.add(base_ingredient)
+
+        # Shared words of at least 3 letters
+        for word in product_words:
+            if len(word) > 2:
+                matched.update(self.token_bases.get(word, ()))
+
+        if self.fuzzy is not None:
+            matched |= self.fuzzy.matching_bases(product_words)
+
+        return matched
+
+    def session_bases(self, products):
+        matched = set()
+        for product in products:
+            matched |= self.matching_bases(product)
+        return matched
+
+    def match_counts(self, products):
+        """Map recipe position -> number of its ingredients matched by any of the products."""
+        matched = self.session_bases(products)
+        if self.snapshot is not None:
+            return self.snapshot.match_counts(matched)
+
+        counts = defaultdict(int)
+        for base_ingredient in matched:
+            for position, occurrences in self.postings[base_ingredient]:
+                counts[position] += occurrences
+        return counts
+
+class RecipeIndexLoader:
+    """
+    Keeps a RecipeIndex for recipes.db and rebuilds it when the file changes. With a
+    snapshot_dir the index is served from a memory-mapped snapshot (see
+    recipe_snapshot.py), which is exported first if none matches the current recipes.db.
+    """
+
+    def __init__(self, db_path='backend/recipes.db', forms_path='backend/ingredient_forms.db',
+                 match_mode='strict', fuzzy_threshold=0.6, snapshot_dir=None):
+        self.db_path = db_path
+        self.forms_path = forms_path
+        self.snapshot_dir = snapshot_dir
+        self.match_mode = match_mode
+        self.fuzzy_threshold = fuzzy_threshold
+        self._lock = threading.Lock()
+        self.signature = None
+        self._index = None
+
+    def _db_signature(self):
+        signature = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def get(self):
+        signature = self._db_signature()
+        if signature != self.signature:
+            with self._lock:
+                if signature != self.signature:
+                    self._index = self._build(signature)
+                    self.signature = signature
+                    print(f"Built recipe index: {len(self._index.recipe_ids)} recipes, "
+                          f"{len(self._index.postings)} ingredient forms, {self.match_mode} matching")
+        return self._index
+
+    def _build(self, signature):
+        options = {"match_mode": self.match_mode, "fuzzy_threshold": self.fuzzy_threshold}
+        if not self.snapshot_dir:
+            return RecipeIndex.from_db(self.db_path, self.forms_path, **options)
+        snapshot = RecipeSnapshot.open(self.snapshot_dir, repr(signature))
+        if snapshot is None:
+            write_snapshot(RecipeIndex.from_db(self.db_path, self.forms_path), self.snapshot_dir, repr(signature))
+            snapshot = RecipeSnapshot.open(self.snapshot_dir, repr(signature))
+        return RecipeIndex.from_snapshot(snapshot, **options)
@@ -0,0 +1,134 @@
+import os
+import threading
+
+import numpy as np
+
+class RecipeMatrix:
+    """
+    Sparse recipe x ingredient matrix (CSR arrays) built from a RecipeIndex.
+
+    Columns are ingredient base forms and entries count how often a recipe lists
+    one. A session becomes a 0/1 vector over the columns, every recipe's number
+    of matching ingredients is one sparse matrix-vector product, and the best
+    matches are picked with a partial sort. Results are identical to scoring
+    with the index: same counts, same rounded percentages, ties in table order.
+    """
+
+    def __init__(self, indptr, indices, data, totals, vocabulary, columns=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.totals = totals
+        self.vocabulary = vocabulary
+        if columns is None:
+            columns = {base: column for column, base in enumerate(vocabulary.tolist())}
+        self.columns = columns
+        # Row of every stored entry, so the product is a single bincount
+        self.entry_rows = np.repeat(np.arange(len(totals), dtype=np.int32), np.diff(indptr))
+
+        # round(count / total * 100, 2) for every possible pair, computed with Python's
+        # round so the percentages are bit-for-bit the ones /generate_recipe always returned
+        max_total = int(totals.max()) if len(totals) else 0
+        self.percentages = np.zeros((max_total + 1, max_total + 1))
+        for total in np.unique(totals).tolist():
+            for count in range(1, total + 1):
+                self.percentages[count, total] = round((count / total) * 100, 2)
+
+    @classmethod
+    def from_index(cls, index):
+        vocabulary = sorted(index.postings)
+        rows = [[] for _ in index.recipe_ids]
+        for column, base in enumerate(vocabulary):
+            for position, occurrences in index.postings[base]:
+                rows[position].append((column, occurrences))
+
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in rows])
+        indices = np.fromiter((column for row in rows for column, _ in row), dtype=np.int32, count=indptr[-1])
+        data = np.fromiter((occurrences for row in rows for _, occurrences in row), dtype=np.int32, count=indptr[-1])
+        totals = np.asarray(index.total_ingredients, dtype=np.int32)
+        return cls(indptr, indices, data, totals, np.asarray(vocabulary, dtype=str))
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Matrix over the snapshot's memory-mapped CSR arrays, nothing to build or save."""
+        return cls(snapshot.csr_indptr, snapshot.csr_indices, snapshot.csr_data, snapshot.totals,
+                   snapshot.vocabulary, snapshot.columns)
+
+    def save(self, path, signature):
+        np.savez(path, indptr=self.indptr, indices=self.indices, data=self.data,
+                 totals=self.totals, vocabulary=self.vocabulary, signature=np.asarray(signature))
+
+    @classmethod
+    def load(cls, path, signature):
+        """The saved matrix, or None when it was built from a different recipes.db."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as saved:
+            if str(saved['signature']) != signature:
+                return None
+            return cls(saved['indptr'], saved['indices'], saved['data'], saved['totals'], saved['vocabulary'])
+
+    def session_vector(self, matched_bases):
+        vector = np.zeros(len(self.vocabulary), dtype=np.float64)
+        columns = [self.columns[base] for base in matched_bases if base in self.columns]
+        vector[columns] = 1
+        return vector
+
+    def match_counts(self, matched_bases):
+        vector = self.session_vector(matched_bases)
+        weights = self.data * vector[self.indices]
+        return np.bincount(self.entry_rows, weights=weights, minlength=len(self.totals)).astype(np.int64)
+
+    def top_matches(self, counts, options, count=None):
+        """
+        ranking.top_matches() over match_counts(), picked in NumPy: scores for every
+        candidate, a partial sort to the count-th best and a sort of what is left, so
+        only the selected recipes become (position, matching_ingredients, match_percentage).
+        """
+        candidates = np.flatnonzero(counts)
+        matched = counts[candidates]
+        percentages = self.percentages[matched, self.totals[candidates]]
+        if options.min_percent:
+            keep = percentages >= options.min_percent
+            candidates, matched, percentages = candidates[keep], matched[keep], percentages[keep]
+        scores = options.weights["percentage"] * percentages + options.weights["matching_ingredients"] * matched
+
+        if count is not None and 0 < count < len(candidates):
+            # Everything scoring at least the count-th best, ties with it included
+            kth = scores[np.argpartition(-scores, count - 1)[:count]].min()
+            keep = scores >= kth
+            candidates, matched, percentages, scores = candidates[keep], matched[keep], percentages[keep], scores[keep]
+
+        # Best score first, then higher percentage, then table order
+        order = np.lexsort((candidates, -percentages, -scores))[:count]
+        return list(zip(candidates[order].tolist(), matched[order].tolist(), percentages[order].tolist()))
+
+class RecipeMatrixLoader:
+    """
+    RecipeMatrix for the current RecipeIndex, saved next to recipes.db as an .npz file.
+    An index served from a snapshot already has the CSR arrays mapped, those are used.
+    """
+
+    def __init__(self, index_loader, path='backend/recipe_matrix.npz'):
+        self.index_loader = index_loader
+        self.path = path
+        self._lock = threading.Lock()
+        self._index = None
+        self._matrix = None
+
+    def get(self):
+        index = self.index_loader.get()
+        if index is not self._index:
+            with self._lock:
+                if index is not self._index:
+                    signature = repr(self.index_loader.signature)
+                    if index.snapshot is not None:
+                        matrix = RecipeMatrix.from_snapshot(index.snapshot)
+                    else:
+                        matrix = RecipeMatrix.load(self.path, signature)
+                        if matrix is None:
+                            matrix = RecipeMatrix.from_index(index)
+                            matrix.save(self.path, signature)
+                    self._matrix, self._index = matrix, index
+        return index, self._matrix
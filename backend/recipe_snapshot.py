@@ -0,0 +1,222 @@
+# Columnar snapshot of the recipe index: flat .npy arrays that every worker
+# memory-maps, so N processes share one copy of the pages instead of each holding
+# the index as Python objects, and a restart opens it instead of re-reading recipes.db.
+#
+# Layout of one snapshot directory (snap-<signature hash>/ under the snapshot root):
+#   manifest.json                   signature of the recipes.db it was built from
+#   recipe_ids, totals              per recipe, in table order
+#   title_offsets, titles           UTF-8 titles packed into one buffer
+#   vocabulary_offsets, vocabulary  ingredient base forms, sorted, packed the same way
+#   csr_indptr, csr_indices, csr_data  recipe -> (base form column, occurrences)
+#   csc_indptr, csc_indices, csc_data  base form column -> (recipe position, occurrences)
+# Instructions aren't in it, they are read from recipes.db by id for the returned matches.
+#
+# Rebuild after recipes.db changes (workers also build it on first start when missing):
+#   python backend/recipe_snapshot.py --recipes backend/recipes.db --out backend/recipe_snapshot
+#   python backend/recipe_snapshot.py --watch 60
+import hashlib
+import json
+import os
+import shutil
+from collections.abc import Mapping
+
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+ARRAYS = ('recipe_ids', 'totals', 'title_offsets', 'titles', 'vocabulary_offsets', 'vocabulary',
+          'csr_indptr', 'csr_indices', 'csr_data', 'csc_indptr', 'csc_indices', 'csc_data')
+
+def snapshot_path(root, signature):
+    return os.path.join(root, 'snap-' + hashlib.sha1(signature.encode('utf-8')).hexdigest()[:16])
+
+def pack_strings(strings):
+    encoded = [text.encode('utf-8') for text in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(data) for data in encoded])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+class PackedStrings:
+    """Read-only sequence of strings over an offsets array and a UTF-8 buffer."""
+
+    def __init__(self, offsets, buffer):
+        self.offsets = offsets
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        data = self.buffer.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield data[start:end].decode('utf-8')
+
+class IntColumn:
+    """Read-only sequence of Python ints over an array, so values serialize like list entries."""
+
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, i):
+        return int(self.array[i])
+
+    def __iter__(self):
+        return iter(self.array.tolist())
+
+class SnapshotPostings(Mapping):
+    """Base form -> [(recipe position, occurrences)], read from the CSC arrays on access."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __getitem__(self, base_ingredient):
+        column = self.snapshot.columns[base_ingredient]
+        start, end = self.snapshot.csc_indptr[column], self.snapshot.csc_indptr[column + 1]
+        return list(zip(self.snapshot.csc_indices[start:end].tolist(), self.snapshot.csc_data[start:end].tolist()))
+
+    def __contains__(self, base_ingredient):
+        return base_ingredient in self.snapshot.columns
+
+    def __iter__(self):
+        return iter(self.snapshot.vocabulary)
+
+    def __len__(self):
+        return len(self.snapshot.vocabulary)
+
+def write_snapshot(index, root, signature):
+    """Export a RecipeIndex to a snapshot directory under root, returns its path."""
+    path = snapshot_path(root, signature)
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        return path
+
+    vocabulary = sorted(index.postings)
+    csc_indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    csc_indptr[1:] = np.cumsum([len(index.postings[base]) for base in vocabulary])
+    csc_indices = np.fromiter((position for base in vocabulary for position, _ in index.postings[base]),
+                              dtype=np.int32, count=csc_indptr[-1])
+    csc_data = np.fromiter((occurrences for base in vocabulary for _, occurrences in index.postings[base]),
+                           dtype=np.int32, count=csc_indptr[-1])
+    columns = np.repeat(np.arange(len(vocabulary), dtype=np.int32), np.diff(csc_indptr))
+
+    # Same entries ordered by recipe, then column
+    order = np.lexsort((columns, csc_indices))
+    csr_indptr = np.zeros(len(index.recipe_ids) + 1, dtype=np.int64)
+    csr_indptr[1:] = np.cumsum(np.bincount(csc_indices, minlength=len(index.recipe_ids)))
+
+    title_offsets, titles = pack_strings(index.titles)
+    vocabulary_offsets, vocabulary_buffer = pack_strings(vocabulary)
+    arrays = {
+        'recipe_ids': np.asarray(index.recipe_ids, dtype=np.int64),
+        'totals': np.asarray(index.total_ingredients, dtype=np.int32),
+        'title_offsets': title_offsets,
+        'titles': titles,
+        'vocabulary_offsets': vocabulary_offsets,
+        'vocabulary': vocabulary_buffer,
+        'csr_indptr': csr_indptr,
+        'csr_indices': columns[order],
+        'csr_data': csc_data[order],
+        'csc_indptr': csc_indptr,
+        'csc_indices': csc_indices,
+        'csc_data': csc_data,
+    }
+
+    # Written next to its final place and renamed, readers never see half a snapshot
+    os.makedirs(root, exist_ok=True)
+    staging = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(staging, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), array)
+    with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+        json.dump({"version": SNAPSHOT_VERSION, "signature": signature,
+                   "recipes": len(index.recipe_ids), "ingredient_forms": len(vocabulary)}, f)
+    try:
+        os.rename(staging, path)
+    except OSError:
+        # Another process got there first
+        shutil.rmtree(staging, ignore_errors=True)
+    return path
+
+def remove_old_snapshots(root, keep):
+    """Delete every snapshot under root but `keep`. Workers still mapping one keep their pages."""
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith('snap-') and path != keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+class RecipeSnapshot:
+    def __init__(self, path, manifest, arrays):
+        self.path = path
+        self.manifest = manifest
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.recipe_ids = IntColumn(arrays['recipe_ids'])
+        self.totals = arrays['totals']
+        self.titles = PackedStrings(arrays['title_offsets'], arrays['titles'])
+        # The one structure every worker builds for itself: base form lookups need a dict
+        self.vocabulary = list(PackedStrings(arrays['vocabulary_offsets'], arrays['vocabulary']))
+        self.columns = {base: column for column, base in enumerate(self.vocabulary)}
+
+    def match_counts(self, matched_bases):
+        """Map recipe position -> occurrences of the matched base forms, one bincount over their postings."""
+        columns = [self.columns[base] for base in matched_bases if base in self.columns]
+        if not columns:
+            return {}
+        columns = np.asarray(columns)
+        starts = self.csc_indptr[columns]
+        lengths = self.csc_indptr[columns + 1] - starts
+        # Positions of every posting of those columns, gathered in one go
+        entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        counts = np.bincount(self.csc_indices[entries], weights=self.csc_data[entries], minlength=len(self.totals))
+        hits = np.flatnonzero(counts)
+        return dict(zip(hits.tolist(), counts[hits].astype(np.int64).tolist()))
+
+    @classmethod
+    def open(cls, root, signature):
+        """The snapshot built from this recipes.db signature, memory-mapped, or None if there is none."""
+        path = snapshot_path(root, signature)
+        try:
+            with open(os.path.join(path, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        if manifest.get("version") != SNAPSHOT_VERSION or manifest.get("signature") != signature:
+            return None
+        # Plain ndarray views of the maps, slicing an np.memmap is much slower
+        arrays = {name: np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')) for name in ARRAYS}
+        return cls(path, manifest, arrays)
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from recipe_index import RecipeIndexLoader
+
+    parser = argparse.ArgumentParser(description="Build the memory-mapped recipe snapshot")
+    parser.add_argument('--recipes', default='backend/recipes.db')
+    parser.add_argument('--forms', default='backend/ingredient_forms.db')
+    parser.add_argument('--out', default='backend/recipe_snapshot')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help="keep running and rebuild whenever recipes.db changes, checking this often")
+    parser.add_argument('--keep-old', action='store_true', help="don't delete snapshots of older recipe tables")
+    args = parser.parse_args()
+
+    loader = RecipeIndexLoader(args.recipes, args.forms)
+    built = None
+    while True:
+        signature = repr(loader._db_signature())
+        if signature != built:
+            started = time.perf_counter()
+            path = write_snapshot(loader.get(), args.out, repr(loader.signature))
+            built = repr(loader.signature)
+            if not args.keep_old:
+                remove_old_snapshots(args.out, path)
+            print(f"Snapshot {path} ready in {time.perf_counter() - started:.1f}s")
+        if not args.watch:
+            break
+        time.sleep(args.watch)
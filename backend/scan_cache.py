@@ -0,0 +1,117 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import metrics
+
+# dHash of a (HASH_SIZE + 1) x HASH_SIZE thumbnail, HASH_SIZE ** 2 bits
+HASH_SIZE = 16
+# Thumbnails with less grey-level spread than this (blank or badly exposed shots) aren't hashed
+MIN_CONTRAST = 4
+
+def exact_hash(image_data):
+    return hashlib.blake2b(image_data, digest_size=16).digest()
+
+def perceptual_hash(image_data):
+    """
+    Difference hash of the image as an int, None when it can't be decoded or is too
+    flat to tell apart from other flat images. JPEGs are decoded at 1/8 scale, which
+    skips most of the work of a full decode.
+    """
+    try:
+        small = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    except cv2.error:
+        return None
+    if small is None:
+        return None
+    thumbnail = cv2.resize(small, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    if thumbnail.std() < MIN_CONTRAST:
+        return None
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+class ScanCache:
+    """
+    Decoded barcodes by image content, in front of scan_barcodes.
+
+    An upload whose bytes were seen before gets the earlier result. Otherwise its
+    perceptual hash is compared with the cached ones of the same session: a
+    near-identical shot (at most max_distance differing hash bits) gets the barcodes
+    decoded from the earlier shot. Similar shots from different users may well show
+    different products (two cans on the same counter), so they are never matched
+    across sessions. Only shots that had barcodes are matched that way, a retake of a
+    photo that failed is always decoded again. Identical uploads arriving together are
+    decoded once.
+    """
+
+    def __init__(self, max_entries=1024, max_distance=8):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._lru = OrderedDict()  # exact hash -> (session, perceptual hash or None, (barcodes, message))
+        self._pending = {}         # exact hash -> [threading.Event, result] of a decode in progress
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0}
+
+    def _count(self, stat):
+        metrics.tag(stat)
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _similar(self, phash, session):
+        with self._lock:
+            for key, (cached_session, cached_phash, result) in self._lru.items():
+                if (cached_session == session and cached_phash is not None and result[0]
+                        and bin(cached_phash ^ phash).count('1') <= self.max_distance):
+                    self._lru.move_to_end(key)
+                    return result
+        return None
+
+    def scan(self, image_data, scan, session=None):
+        """
+        scan(image_data) -> (barcodes, message), answered from the cache when possible.
+        Without a session only exact matches are used.
+        """
+        if self.max_entries <= 0:
+            return scan(image_data)
+
+        key = exact_hash(image_data)
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+            pending = self._pending.get(key)
+            owner = entry is None and pending is None
+            if owner:
+                pending = self._pending[key] = [threading.Event(), None]
+        if entry is not None:
+            self._count("exact_hits")
+            return entry[2]
+        if not owner:
+            pending[0].wait()
+            if pending[1] is not None:
+                self._count("exact_hits")
+                return pending[1]
+            return self.scan(image_data, scan, session)
+
+        result = None
+        try:
+            phash = perceptual_hash(image_data)
+            result = self._similar(phash, session) if phash is not None and session is not None else None
+            if result is not None:
+                self._count("similar_hits")
+            else:
+                self._count("misses")
+                result = scan(image_data)
+            with self._lock:
+                self._lru[key] = (session, phash, result)
+                while len(self._lru) > self.max_entries:
+                    self._lru.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending[1] = result
+            pending[0].set()
+        return result
@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+from pyzbar.pyzbar import decode
+
+# Longest side of the image used by the first, cheapest detection stage
+FAST_PASS_MAX_SIDE = 1024
+# Barcode-shaped regions tried by the last stage
+MAX_REGIONS = 6
+
+def load_grayscale(image):
+    """Decode an image straight to grayscale from a file path or from encoded bytes (e.g. an upload)."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    return cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+
+def preprocess_image(image):
+    gray = load_grayscale(image)
+    if gray is None:
+        raise ValueError("Failed to load image")
+    _, thresh = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY)
+    return thresh
+
+def downscale(gray, max_side):
+    scale = max_side / max(gray.shape[:2])
+    if scale >= 1:
+        return gray, 1.0
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+def find_barcode_regions(gray):
+    """Bounding boxes (x, y, w, h) of areas dense in parallel edges, largest first."""
+    small, scale = downscale(gray, 800)
+    grad_x = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=-1)
+    grad_y = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=-1)
+
+    regions = []
+    # Bars run vertically for upright barcodes and horizontally for rotated ones
+    for gradient, kernel_size in ((cv2.subtract(grad_x, grad_y), (21, 7)),
+                                  (cv2.subtract(grad_y, grad_x), (7, 21))):
+        gradient = cv2.convertScaleAbs(gradient)
+        blurred = cv2.blur(gradient, (9, 9))
+        _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size))
+        mask = cv2.dilate(cv2.erode(mask, None, iterations=4), None, iterations=4)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w * h >= 0.002 * small.shape[0] * small.shape[1]:
+                regions.append((w * h, x, y, w, h))
+
+    boxes = []
+    height, width = gray.shape[:2]
+    for _, x, y, w, h in sorted(regions, reverse=True)[:MAX_REGIONS]:
+        # Back to full resolution, with a margin so the quiet zone is included
+        pad_x, pad_y = int(w * 0.15) + 4, int(h * 0.15) + 4
+        x0 = max(0, int((x - pad_x) / scale))
+        y0 = max(0, int((y - pad_y) / scale))
+        x1 = min(width, int((x + w + pad_x) / scale))
+        y1 = min(height, int((y + h + pad_y) / scale))
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+    return boxes
+
+# Detection stages, cheapest first. Each yields the candidate images it wants decoded.
+def downscaled_pass(gray):
+    small, _ = downscale(gray, FAST_PASS_MAX_SIDE)
+    yield small
+
+def threshold_pass(gray):
+    _, fixed = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY)
+    yield fixed
+    _, otsu = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    yield otsu
+
+def adaptive_pass(gray):
+    yield cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+
+def region_pass(gray):
+    for x, y, w, h in find_barcode_regions(gray):
+        crop = gray[y:y + h, x:x + w]
+        if max(crop.shape[:2]) < 400:
+            crop = cv2.resize(crop, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+        yield crop
+        _, otsu = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        yield otsu
+
+DETECTION_STAGES = [
+    ("downscaled", downscaled_pass),
+    ("threshold", threshold_pass),
+    ("adaptive", adaptive_pass),
+    ("roi", region_pass),
+]
+
+def decode_all(candidate):
+    return [(barcode.data.decode("utf-8"), barcode.type) for barcode in decode(candidate)]
+
+def detect_barcodes(gray, stages=DETECTION_STAGES):
+    """
+    Run the detection stages in order and stop at the first one that finds
+    anything. Returns (distinct barcode strings in detection order, stage name).
+    """
+    for name, stage in stages:
+        found = []
+        for candidate in stage(gray):
+            for barcode_data, _ in decode_all(candidate):
+                if barcode_data not in found:
+                    found.append(barcode_data)
+        if found:
+            return found, name
+    return [], None
+
+def scan_barcodes(image):
+    """All barcodes in an image (file path or encoded bytes) -> (barcodes, message)."""
+    try:
+        gray = load_grayscale(image)
+        if gray is None:
+            raise ValueError("Failed to load image")
+        barcodes, _ = detect_barcodes(gray)
+
+        if not barcodes:
+            return [], "No barcode detected"
+
+        return barcodes, f"Barcode detected: {', '.join(barcodes)}"
+    except Exception as e:
+        return [], f"Error processing barcode: {str(e)}"
+
+def scan_barcode(image):
+    # Single barcode API used by the CLI scripts
+    barcodes, message = scan_barcodes(image)
+    if not barcodes:
+        return None, message
+    return barcodes[0], f"Barcode detected: {barcodes[0]}"
@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import metrics
+
+class SessionMatches:
+    """
+    Match counts of one session, kept up to date as products are scanned.
+
+    A recipe's count only depends on which ingredient base forms the session
+    matches, so a new product just adds the postings of the base forms no other
+    product matched yet. Products are keyed by barcode like session_inventory,
+    so a rescan changes nothing and a barcode whose product changed replaces it.
+    Callers hold `lock` around add_products() and ranked().
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.lock = threading.Lock()
+        self.version = None  # the session's stored version these counts reflect
+        self.product_bases = {}  # barcode -> base forms the product matches
+        self.base_refs = defaultdict(int)  # base form -> products matching it
+        self.counts = defaultdict(int)  # recipe position -> matching ingredients
+        self._ranked = None
+
+    def _apply(self, base_ingredient, sign):
+        for position, occurrences in self.index.postings[base_ingredient]:
+            self.counts[position] += sign * occurrences
+            if not self.counts[position]:
+                del self.counts[position]
+
+    def add_products(self, products):
+        for product in products:
+            bases = self.index.matching_bases(product)
+            previous = self.product_bases.get(product['barcode'])
+            if previous == bases:
+                continue
+            self.product_bases[product['barcode']] = bases
+            for base_ingredient in previous or ():
+                self.base_refs[base_ingredient] -= 1
+                if not self.base_refs[base_ingredient]:
+                    del self.base_refs[base_ingredient]
+                    self._apply(base_ingredient, -1)
+            for base_ingredient in bases:
+                self.base_refs[base_ingredient] += 1
+                if self.base_refs[base_ingredient] == 1:
+                    self._apply(base_ingredient, 1)
+            self._ranked = None
+
+    def ranked(self):
+        """(position, matching_ingredients, match_percentage) best first, ties in table order."""
+        if self._ranked is None:
+            totals = self.index.total_ingredients
+            scored = [(position, count, round((count / totals[position]) * 100, 2))
+                      for position, count in self.counts.items()]
+            self._ranked = sorted(scored, key=lambda match: (-match[2], match[0]))
+        return self._ranked
+
+class SessionMatchCache:
+    """
+    SessionMatches per session id with LRU and idle-time eviction. A session that
+    isn't in memory (evicted, restarted, or scored on an older recipe index) is
+    rebuilt from its stored products on the next read.
+
+    Other processes (server workers, job workers) save products to the same database,
+    so every read compares the session's stored version, from load_version, with the
+    one the counts were built from and rebuilds them when it differs.
+
+    The cache lock only guards the session table. Matching products and sorting a
+    ranking happen under the session's own lock, so a large scan or a cold rebuild
+    of one session never holds up the others.
+    """
+
+    def __init__(self, index_loader, load_products, load_version, max_sessions=1000, ttl=3600):
+        self.index_loader = index_loader
+        self.load_products = load_products  # session id -> products
+        self.load_version = load_version  # session id -> version of its stored products
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session id -> (SessionMatches, last used)
+        # session id -> [rebuilds in flight, products saved while they read the database]
+        self._rebuilding = {}
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - last_used < self.ttl:
+                break
+            del self._sessions[session_id]
+
+    def add_products(self, session_id, products, before, after):
+        """
+        Fold newly saved products into the session's counts, if the session is in memory.
+        before and after are the session's stored versions around the write.
+        """
+        index = self.index_loader.get()
+        with self._lock:
+            if session_id in self._rebuilding:
+                self._rebuilding[session_id][1].extend(products)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            state = entry[0]
+            if state.index is not index:
+                del self._sessions[session_id]
+                return
+            self._sessions[session_id] = (state, time.time())
+            self._sessions.move_to_end(session_id)
+        with state.lock:
+            if state.version != before:
+                # Another process saved products since these counts were built, rebuild on the next read
+                state.version = None
+                return
+            state.add_products(products)
+            state.version = after
+
+    def ranked(self, session_id, limit=None):
+        """(index, [(position, matching_ingredients, match_percentage)]) of the session's best matches."""
+        index = self.index_loader.get()
+        version = self.load_version(session_id)
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            state = entry[0] if entry is not None and entry[0].index is index and entry[0].version == version else None
+            rebuilding = None
+            if state is None:
+                rebuilding = self._rebuilding.setdefault(session_id, [0, []])
+                rebuilding[0] += 1
+
+        metrics.tag('hit' if state is not None else 'miss')
+        late = []
+        if state is None:
+            try:
+                products = self.load_products(session_id)
+                with self._lock:
+                    saved = list(rebuilding[1])
+                # Products saved during the read may already be in it, adding them again is harmless.
+                # Nobody else sees this state yet, it is built without any lock.
+                state = SessionMatches(index)
+                state.add_products(products + saved)
+                # Read before the products, a write in between only costs another rebuild
+                state.version = version
+            except Exception:
+                with self._lock:
+                    self._finish_rebuild(session_id, rebuilding)
+                raise
+
+        now = time.time()
+        with self._lock:
+            if rebuilding is not None:
+                self._finish_rebuild(session_id, rebuilding)
+                # Saved while it was being built, from here on add_products finds it in the table
+                late = rebuilding[1][len(saved):]
+            self._sessions[session_id] = (state, now)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+        with state.lock:
+            if late:
+                state.add_products(late)
+            return index, state.ranked()[:limit]
+
+    def _finish_rebuild(self, session_id, rebuilding):
+        rebuilding[0] -= 1
+        if rebuilding[0] == 0:
+            del self._rebuilding[session_id]
@@ -0,0 +1,90 @@
+# Retention for products.db: sessions with no scans for a while are moved to an
+# archive database so scanned_products and session_inventory stay small.
+#   python backend/sessions.py --days 30 --vacuum
+import argparse
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+PRODUCT_COLUMNS = ('id, barcode, product_name, category, scan_date, session_id, '
+                   'normalized_name, normalized_category, tokens, specific_category')
+
+def archive_old_sessions(conn, archive_path, max_age_days):
+    """Move every session whose last scan is older than max_age_days into archive_path."""
+    cutoff = datetime.now() - timedelta(days=max_age_days)
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS archive.scanned_products (
+                id INTEGER PRIMARY KEY,
+                barcode TEXT,
+                product_name TEXT,
+                category TEXT,
+                scan_date TIMESTAMP,
+                session_id TEXT,
+                normalized_name TEXT,
+                normalized_category TEXT,
+                tokens TEXT,
+                specific_category TEXT
+            )
+        ''')
+        # Archives created before specific categories were stored
+        columns = {row[1] for row in conn.execute('PRAGMA archive.table_info(scanned_products)')}
+        if 'specific_category' not in columns:
+            conn.execute('ALTER TABLE archive.scanned_products ADD COLUMN specific_category TEXT')
+        with conn:
+            conn.execute('''
+                CREATE TEMP TABLE stale_sessions AS
+                SELECT session_id FROM session_inventory
+                GROUP BY session_id
+                HAVING MAX(last_scanned) < ?
+            ''', (cutoff,))
+            stale = conn.execute('SELECT COUNT(*) FROM temp.stale_sessions').fetchone()[0]
+            moved = conn.execute(f'''
+                INSERT OR IGNORE INTO archive.scanned_products ({PRODUCT_COLUMNS})
+                SELECT {PRODUCT_COLUMNS} FROM main.scanned_products
+                WHERE session_id IN (SELECT session_id FROM temp.stale_sessions)
+            ''').rowcount
+            conn.execute('''
+                DELETE FROM main.scanned_products
+                WHERE session_id IN (SELECT session_id FROM temp.stale_sessions)
+            ''')
+            conn.execute('''
+                DELETE FROM main.session_inventory
+                WHERE session_id IN (SELECT session_id FROM temp.stale_sessions)
+            ''')
+            conn.execute('DROP TABLE temp.stale_sessions')
+    finally:
+        conn.execute('DETACH DATABASE archive')
+
+    print(f"Archived {stale} sessions ({moved} scans) older than {max_age_days} days")
+    return stale
+
+def start_retention_job(pool, archive_path, max_age_days, interval=3600):
+    """Run archive_old_sessions every `interval` seconds on a daemon thread."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                with pool.connection() as conn:
+                    archive_old_sessions(conn, archive_path, max_age_days)
+            except Exception as e:
+                print(f"Session retention job failed: {str(e)}")
+
+    threading.Thread(target=run, name='session-retention', daemon=True).start()
+    return stop
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old sessions out of products.db")
+    parser.add_argument('--db', default='backend/products.db')
+    parser.add_argument('--archive', default='backend/products_archive.db')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--vacuum', action='store_true', help="reclaim the freed pages afterwards")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    archive_old_sessions(conn, args.archive, args.days)
+    if args.vacuum:
+        conn.execute('VACUUM')
+    conn.close()
@@ -0,0 +1,420 @@
+# Cache tier shared by the product, instruction and thumbnail stores, so backend
+# instances reuse each other's upstream answers. The backend is picked with CACHE_BACKEND:
+#   memory                        in-process, every worker keeps its own (the default)
+#   sqlite:///path/to/cache.db    a SQLite file in WAL mode, shared by the processes of one host
+#   redis://host:6379/0           any Redis-compatible server, shared by every instance
+# Try the Redis one locally against the stand-in: python backend/stub_servers.py --redis-port 6379
+import asyncio
+import json
+import queue
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from db import ConnectionPool
+
+class MemoryBackend:
+    """String values with an optional TTL in an LRU dict, for one process."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def init_db(self):
+        pass
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            values = {key: self._live(key, now) for key in keys}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key, value, ttl):
+        """Set the key only if it has no live value, returns whether it was set."""
+        with self._lock:
+            if self._live(key, time.time()) is not None:
+                return False
+            self._entries[key] = (value, time.time() + ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_if(self, key, value):
+        """Delete the key only while it still holds value."""
+        with self._lock:
+            if self._live(key, time.time()) == value:
+                del self._entries[key]
+
+class SQLiteBackend:
+    """String values with an optional TTL in a SQLite table, shared by every process opening the file."""
+
+    def __init__(self, db_path='backend/shared_cache.db', purge_interval=600):
+        self.db = ConnectionPool(db_path)
+        self.purge_interval = purge_interval
+        self._last_purge = time.time()
+
+    def init_db(self):
+        with self.db.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    expires_at REAL
+                )
+            ''')
+            conn.commit()
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        placeholders = ', '.join('?' for _ in keys)
+        with self.db.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT key, value FROM cache_entries
+                WHERE key IN ({placeholders}) AND (expires_at IS NULL OR expires_at > ?)
+            ''', [*keys, time.time()]).fetchall()
+        return dict(rows)
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self.db.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+                         (key, value, now + ttl if ttl else None))
+            # Expired entries are only skipped by reads, clear them out now and then
+            if now - self._last_purge > self.purge_interval:
+                self._last_purge = now
+                conn.execute('DELETE FROM cache_entries WHERE expires_at <= ?', (now,))
+            conn.commit()
+
+    def add(self, key, value, ttl):
+        now = time.time()
+        with self.db.connection() as conn:
+            # One write transaction, so two processes can't both take the key
+            conn.execute('DELETE FROM cache_entries WHERE key = ? AND expires_at <= ?', (key, now))
+            added = conn.execute('INSERT OR IGNORE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+                                 (key, value, now + ttl)).rowcount
+            conn.commit()
+        return added == 1
+
+    def delete(self, key):
+        with self.db.connection() as conn:
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            conn.commit()
+
+    def delete_if(self, key, value):
+        with self.db.connection() as conn:
+            conn.execute('DELETE FROM cache_entries WHERE key = ? AND value = ?', (key, value))
+            conn.commit()
+
+class RedisError(Exception):
+    pass
+
+class RedisBackend:
+    """
+    Any server speaking the Redis protocol (RESP). Only GET/MGET/SET/DEL and one EVAL
+    script are used, so this small client over pooled sockets is enough and there is
+    no extra dependency.
+    """
+
+    # Compare-and-delete in one step, a plain GET then DEL could remove a lock taken over in between
+    DELETE_IF_SCRIPT = 'if redis.call("get", KEYS[1]) == ARGV[1] then return redis.call("del", KEYS[1]) else return 0 end'
+
+    def __init__(self, host='localhost', port=6379, db=0, timeout=2.0, size=8):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        connection = (sock, sock.makefile('rb'))
+        if self.db:
+            self._send(connection, 'SELECT', self.db)
+        return connection
+
+    @staticmethod
+    def _read(reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Connection closed by the cache server")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b'+':
+            return rest.decode('utf-8')
+        if prefix == b'-':
+            raise RedisError(rest.decode('utf-8'))
+        if prefix == b':':
+            return int(rest)
+        if prefix == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return reader.read(length + 2)[:-2].decode('utf-8')
+        if prefix == b'*':
+            length = int(rest)
+            return None if length < 0 else [RedisBackend._read(reader) for _ in range(length)]
+        raise RedisError(f"Unexpected reply from the cache server: {line[:50]!r}")
+
+    def _send(self, connection, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = str(arg).encode('utf-8')
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        connection[0].sendall(b''.join(parts))
+        return self._read(connection[1])
+
+    def command(self, *args):
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+        try:
+            reply = self._send(connection, *args)
+        except Exception:
+            # The connection may be half way through a reply, don't hand it out again
+            connection[0].close()
+            raise
+        if self._idle.qsize() < self.size:
+            self._idle.put(connection)
+        else:
+            connection[0].close()
+        return reply
+
+    def init_db(self):
+        self.command('PING')
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        return {key: value for key, value in zip(keys, self.command('MGET', *keys)) if value is not None}
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.command('SET', key, value, 'PX', int(ttl * 1000))
+        else:
+            self.command('SET', key, value)
+
+    def add(self, key, value, ttl):
+        return self.command('SET', key, value, 'NX', 'PX', int(ttl * 1000)) == 'OK'
+
+    def delete(self, key):
+        self.command('DEL', key)
+
+    def delete_if(self, key, value):
+        self.command('EVAL', self.DELETE_IF_SCRIPT, 1, key, value)
+
+def open_backend(url):
+    """The backend for a CACHE_BACKEND value."""
+    if url == 'memory':
+        return MemoryBackend()
+    if url.startswith('sqlite://'):
+        return SQLiteBackend(url[len('sqlite://'):])
+    if url.startswith('redis://'):
+        parsed = urlparse(url)
+        return RedisBackend(parsed.hostname or 'localhost', parsed.port or 6379, int(parsed.path.strip('/') or 0))
+    raise ValueError(f"Unknown cache backend {url}, expected memory, sqlite://<path> or redis://<host>:<port>/<db>")
+
+class SharedCache:
+    """
+    JSON values over a backend, plus request coalescing ("single-flight").
+
+    coalesce(key, fill) makes one fill() call for concurrent callers of the same key:
+    in this process they wait for the first caller, in other processes sharing the
+    backend they wait for the one holding the key's lock and read back the result it
+    publishes (kept for result_ttl, so callers arriving just after it finished get it
+    too). A caller that waited longer than lock_ttl fills it itself. lock_ttl has to
+    outlast the slowest fill (Ollama may take 60 s), or a second process takes the
+    lock while the first is still filling. Each lock holds a token of its owner, and
+    only the owner releases it.
+
+    The cache is never why a request fails: backend errors are counted and answered
+    like misses, and coalescing falls back to calling fill() directly.
+    """
+
+    def __init__(self, backend, lock_ttl=90, poll_interval=0.05, result_ttl=10):
+        self.backend = backend
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self._pending = {}        # key -> [threading.Event, result, error] of a fill in progress
+        self._pending_async = {}  # key -> asyncio.Future of a fill in progress
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "errors": 0, "fills": 0, "coalesced": 0}
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def _failed(self, error):
+        self._count("errors")
+        print(f"Shared cache error: {str(error)}")
+
+    def init_db(self):
+        try:
+            self.backend.init_db()
+        except Exception as e:
+            self._failed(e)
+
+    def get_many(self, keys):
+        try:
+            values = self.backend.get_many(list(keys))
+        except Exception as e:
+            self._failed(e)
+            return {}
+        self._count("hits", len(values))
+        self._count("misses", len(keys) - len(values))
+        return {key: json.loads(value) for key, value in values.items()}
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.backend.set(key, json.dumps(value), ttl)
+        except Exception as e:
+            self._failed(e)
+
+    def _try_acquire(self, key, token):
+        """(owner, published), or None while another process holds the key's lock without a result yet."""
+        try:
+            # A fill that just finished elsewhere answers for us too
+            published = self.backend.get_many([f"flight:{key}"]).get(f"flight:{key}")
+            if published is not None:
+                return False, json.loads(published)[0]
+            if self.backend.add(f"lock:{key}", token, self.lock_ttl):
+                return True, None
+        except Exception as e:
+            self._failed(e)
+            return True, None
+        return None
+
+    def _publish(self, key, result):
+        # Read back by the processes waiting on the lock, before it is released
+        try:
+            self.backend.set(f"flight:{key}", json.dumps([result]), self.result_ttl)
+        except Exception as e:
+            self._failed(e)
+
+    def _release(self, key, token):
+        try:
+            # Our lock may have expired and been taken by another process, leave theirs alone
+            self.backend.delete_if(f"lock:{key}", token)
+        except Exception as e:
+            self._failed(e)
+
+    def _fill(self, key, fill):
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_ttl
+        acquired = self._try_acquire(key, token)
+        while acquired is None:
+            if time.monotonic() > deadline:
+                acquired = (True, None)
+                break
+            time.sleep(self.poll_interval)
+            acquired = self._try_acquire(key, token)
+        owner, published = acquired
+        if not owner:
+            self._count("coalesced")
+            return published
+
+        self._count("fills")
+        try:
+            result = fill()
+            self._publish(key, result)
+        finally:
+            self._release(key, token)
+        return result
+
+    def coalesce(self, key, fill):
+        """fill() -> JSON-serializable result, called once for all concurrent callers of key."""
+        with self._lock:
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = [threading.Event(), None, None]
+        if not owner:
+            self._count("coalesced")
+            pending[0].wait()
+            if pending[2] is not None:
+                raise pending[2]
+            return pending[1]
+
+        try:
+            pending[1] = self._fill(key, fill)
+            return pending[1]
+        except Exception as e:
+            pending[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending[0].set()
+
+    async def coalesce_async(self, key, fill):
+        """
+        coalesce() for the async server, fill is a coroutine function. The backend
+        calls block (sockets, SQLite), so they run in the default executor.
+        """
+        pending = self._pending_async.get(key)
+        if pending is not None:
+            self._count("coalesced")
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        pending = self._pending_async[key] = loop.create_future()
+        try:
+            token = uuid.uuid4().hex
+            deadline = time.monotonic() + self.lock_ttl
+            acquired = await loop.run_in_executor(None, self._try_acquire, key, token)
+            while acquired is None:
+                if time.monotonic() > deadline:
+                    acquired = (True, None)
+                    break
+                await asyncio.sleep(self.poll_interval)
+                acquired = await loop.run_in_executor(None, self._try_acquire, key, token)
+            owner, result = acquired
+            if owner:
+                self._count("fills")
+                try:
+                    result = await fill()
+                    await loop.run_in_executor(None, self._publish, key, result)
+                finally:
+                    await loop.run_in_executor(None, self._release, key, token)
+            else:
+                self._count("coalesced")
+            pending.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # Retrieved here so a failure nobody else waited for isn't logged as never retrieved
+            pending.exception()
+            raise
+        finally:
+            del self._pending_async[key]
@@ -0,0 +1,199 @@
+# Local stand-ins for the upstream services, so the backend can be exercised
+# without hitting the real APIs. Point the backend at them with e.g.
+#   OPENFOODFACTS_URL=http://localhost:8001 OLLAMA_URL=http://localhost:8002 \
+#   BING_IMAGES_URL=http://localhost:8003/images/search python backend/main.py
+# and, for the shared cache tier, CACHE_BACKEND=redis://localhost:6379 with --redis-port 6379.
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler
+
+SAMPLE_PRODUCTS = {
+    "5449000000996": {"product_name": "Coca-Cola", "categories": "Beverages, Carbonated drinks, Sodas, Colas"},
+    "5449000000439": {"product_name": "Coca-Cola Zero", "categories": "Beverages, Carbonated drinks, Sodas, Colas"},
+    "3017620422003": {"product_name": "Nutella", "categories": "Breakfasts, Spreads, Sweet spreads, Cocoa and hazelnuts spreads"},
+    "0028400090858": {"product_name": "Ruffles Original", "categories": "Snacks, Salty snacks, Crisps, Potato crisps"},
+    "9556001103403": {"product_name": "Fresh Milk", "categories": "Dairies, Milks, Fresh milks, Pasteurised milks"},
+}
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class OpenFoodFactsHandler(StubHandler):
+    """Answers /api/v0/product/<barcode>.json like world.openfoodfacts.org."""
+    products = SAMPLE_PRODUCTS
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        match = re.match(r'^/api/v0/product/(\w+)\.json$', self.path)
+        if not match:
+            self.send_json({"status": 0, "status_verbose": "invalid request"}, status=404)
+            return
+        barcode = match.group(1)
+        if barcode in self.products:
+            self.send_json({"code": barcode, "status": 1, "product": self.products[barcode]})
+        else:
+            self.send_json({"code": barcode, "status": 0, "status_verbose": "product not found"})
+
+class OllamaHandler(StubHandler):
+    """Answers POST /api/generate like a local Ollama, numbering the sentences of the raw instructions."""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if self.path != '/api/generate':
+            self.send_json({"error": "not found"}, status=404)
+            return
+        time.sleep(self.latency)
+        raw = body.get('prompt', '').split('Raw instructions:')[-1]
+        steps = [s.strip() for s in re.split(r'(?<=[.!?])\s+', raw) if s.strip()]
+        text = '\n'.join(f"{i}. {step}" for i, step in enumerate(steps, start=1))
+        if not body.get('stream', True):
+            self.send_json({"model": body.get('model'), "response": text, "done": True})
+            return
+
+        # Streaming responses are NDJSON, one chunk per word
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        for word in re.findall(r'\S+\s*', text):
+            self.wfile.write(json.dumps({"model": body.get('model'), "response": word, "done": False}).encode() + b'\n')
+            self.wfile.flush()
+        self.wfile.write(json.dumps({"model": body.get('model'), "response": "", "done": True}).encode() + b'\n')
+
+class BingImagesHandler(StubHandler):
+    """Answers GET /images/search with a results page shaped like Bing's."""
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        query = re.sub(r'\W+', '-', self.path.split('q=')[-1].split('+filterui')[0]).strip('-').lower()
+        images = ''.join(
+            f'<li><div class="iuscp"><img class="mimg" data-src="https://images.example/{query}-{i}.jpg?w=300" alt=""></div></li>'
+            for i in range(4)
+        )
+        body = f'<html><head><title>{query}</title></head><body><img class="mimg" src="data:image/gif;base64,R0lGOD"><ul>{images}</ul></body></html>'.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class RedisHandler(StreamRequestHandler):
+    """
+    Speaks enough of the Redis protocol for shared_cache.RedisBackend: PING, SELECT,
+    GET, MGET, SET (EX/PX/NX), DEL and EVAL of its compare-and-delete script, kept in
+    memory and shared by all connections.
+    """
+    # The only Lua script it runs, the one of RedisBackend.delete_if
+    DELETE_IF_SCRIPT = 'if redis.call("get", KEYS[1]) == ARGV[1] then return redis.call("del", KEYS[1]) else return 0 end'
+    latency = 0.0
+    entries = {}  # key -> (value, expires_at or None)
+    lock = threading.Lock()
+
+    def read_command(self):
+        header = self.rfile.readline()
+        if not header.startswith(b'*'):
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode('utf-8'))
+        return args
+
+    def bulk(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        data = value.encode('utf-8')
+        return b'$%d\r\n%s\r\n' % (len(data), data)
+
+    def live(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self.entries[key]
+            return None
+        return entry[0] if entry else None
+
+    def execute(self, name, args):
+        with self.lock:
+            if name in ('PING', 'SELECT'):
+                return b'+PONG\r\n' if name == 'PING' else b'+OK\r\n'
+            if name == 'GET':
+                return self.bulk(self.live(args[0]))
+            if name == 'MGET':
+                return b'*%d\r\n' % len(args) + b''.join(self.bulk(self.live(key)) for key in args)
+            if name == 'DEL':
+                removed = sum(self.entries.pop(key, None) is not None for key in args)
+                return b':%d\r\n' % removed
+            if name == 'SET':
+                key, value, options = args[0], args[1], [option.upper() for option in args[2:]]
+                expires_at = None
+                if 'PX' in options:
+                    expires_at = time.time() + int(options[options.index('PX') + 1]) / 1000
+                elif 'EX' in options:
+                    expires_at = time.time() + int(options[options.index('EX') + 1])
+                if 'NX' in options and self.live(key) is not None:
+                    return b'$-1\r\n'
+                self.entries[key] = (value, expires_at)
+                return b'+OK\r\n'
+            if name == 'EVAL':
+                if args[0] != self.DELETE_IF_SCRIPT:
+                    return b'-ERR only the compare-and-delete script is supported\r\n'
+                key, value = args[2], args[3]
+                if self.live(key) != value:
+                    return b':0\r\n'
+                del self.entries[key]
+                return b':1\r\n'
+        return f"-ERR unknown command '{name}'\r\n".encode()
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if not args:
+                return
+            time.sleep(self.latency)
+            self.wfile.write(self.execute(args[0].upper(), args[1:]))
+
+def start_server(handler, port, latency=0.0):
+    """Start a stand-in in a daemon thread, returns the server (call .shutdown() to stop)."""
+    handler = type(handler.__name__, (handler,), {"latency": latency})
+    server = ThreadingHTTPServer(('localhost', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run local stand-ins for the upstream services")
+    parser.add_argument('--openfoodfacts-port', type=int, default=8001)
+    parser.add_argument('--ollama-port', type=int, default=8002)
+    parser.add_argument('--bing-port', type=int, default=8003)
+    parser.add_argument('--redis-port', type=int, default=None, help="also run the Redis-compatible cache stand-in")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args()
+
+    start_server(OpenFoodFactsHandler, args.openfoodfacts_port, args.latency)
+    start_server(OllamaHandler, args.ollama_port, args.latency)
+    print(f"OpenFoodFacts stand-in on http://localhost:{args.openfoodfacts_port}")
+    start_server(BingImagesHandler, args.bing_port, args.latency)
+    print(f"Ollama stand-in on http://localhost:{args.ollama_port}")
+    print(f"Bing image search stand-in on http://localhost:{args.bing_port}/images/search")
+    if args.redis_port:
+        start_server(RedisHandler, args.redis_port, args.latency)
+        print(f"Redis-compatible cache stand-in on redis://localhost:{args.redis_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
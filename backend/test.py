@@ -1,9 +1,11 @@
+# Single-session smoke run against a live server with detailed logging. For timing
+# use the benchmark suite instead: loadtest.py (p50/p95/p99 under concurrent load,
+# optionally against local stand-ins) and bench_micro.py (scan, match, rank).
 import requests
 import json
 import uuid
 from pathlib import Path
 import time
-start_time = time.time()
 
 # Test configuration
 BASE_URL = "http://localhost:8000"
@@ -26,12 +28,13 @@ def detailed_request_test(endpoint, method='POST', **kwargs):
     print(f"Request parameters: {kwargs}")
     
     try:
+        started = time.perf_counter()
         if method.upper() == 'POST':
             response = requests.post(f"{BASE_URL}{endpoint}", **kwargs)
         else:
             response = requests.get(f"{BASE_URL}{endpoint}", **kwargs)
             
-        print(f"Status Code: {response.status_code}")
+        print(f"Status Code: {response.status_code} ({(time.perf_counter() - started) * 1000:.0f} ms)")
         print(f"Response Headers: {dict(response.headers)}")
         print(f"Response Content: {response.text[:200]}...")  # First 200 chars
         
@@ -96,7 +99,3 @@ if __name__ == "__main__":
     
     print("\n=== Testing /generate_recipe endpoint ===")
     recipe_response = test_generate_recipe_endpoint()
-
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    print(f"The program took {elapsed_time:.5f} seconds to run.")
@@ -0,0 +1,237 @@
+# Recipe thumbnail URLs, resolved once per recipe from Bing image search and
+# stored in SQLite. Fill the table ahead of time with
+#   python backend/thumbnails.py
+import asyncio
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+
+import metrics
+from db import ConnectionPool
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+BING_IMAGES_URL = os.environ.get('BING_IMAGES_URL', 'https://www.bing.com/images/search')
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+# Only the result thumbnails are parsed, the rest of the page is skipped
+THUMBNAIL_TAGS = SoupStrainer('img', class_='mimg')
+
+def image_search_url(query):
+    query = query.replace(" ", "+")
+    return f"{BING_IMAGES_URL}?q={query}+filterui:imagesize-large"
+
+def parse_first_image_url(content):
+    soup = BeautifulSoup(content, HTML_PARSER, parse_only=THUMBNAIL_TAGS)
+    image_tags = soup.find_all('img', {'class': 'mimg'})
+    for img in image_tags[1:]:
+        img_url = img.get('data-src') or img.get('src')
+        if img_url and img_url.startswith('http'):
+            return img_url.split('?')[0]
+    return None
+
+def get_first_image_url(query, timeout=5):
+    bing_search_url = image_search_url(query)
+    response = requests.get(bing_search_url, headers=HEADERS, timeout=timeout)
+    response.raise_for_status()
+    return parse_first_image_url(response.content)
+
+class ThumbnailStore:
+    """
+    Thumbnail URL per recipe_id. Recipes with no usable image are remembered too
+    and retried after `retry_missing` seconds. A failed Bing request isn't a "no
+    image" answer: it is recorded apart and the prefetch retries it after
+    `retry_failed` seconds, doubling with every failure up to retry_missing. With a
+    SharedCache, thumbnails other instances resolved are reused and concurrent
+    misses make one Bing request.
+    """
+
+    def __init__(self, db_path='backend/thumbnails.db', retry_missing=7 * 24 * 3600, retry_failed=600,
+                 shared=None):
+        self.db = ConnectionPool(db_path)
+        self.retry_missing = retry_missing
+        self.retry_failed = retry_failed
+        self.shared = shared
+
+    def init_db(self):
+        with self.db.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS recipe_thumbnails (
+                    recipe_id INTEGER PRIMARY KEY,
+                    image_url TEXT,
+                    resolved_at REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS thumbnail_failures (
+                    recipe_id INTEGER PRIMARY KEY,
+                    failures INTEGER,
+                    failed_at REAL
+                )
+            ''')
+            conn.commit()
+
+    def lookup(self, recipe_id):
+        """(found, image_url): found is False when the recipe still has to be resolved."""
+        with self.db.connection() as conn:
+            row = conn.execute(
+                'SELECT image_url, resolved_at FROM recipe_thumbnails WHERE recipe_id = ?', (recipe_id,)
+            ).fetchone()
+        if row is None or (row[0] is None and time.time() - row[1] > self.retry_missing):
+            if self.shared is None:
+                return False, None
+            # Resolved by another instance?
+            row = self.shared.get(f"thumbnail:{recipe_id}")
+            if row is None:
+                return False, None
+            self.store(recipe_id, *row, publish=False)
+        return True, row[0]
+
+    def store(self, recipe_id, image_url, resolved_at=None, publish=True):
+        resolved_at = resolved_at or time.time()
+        if publish and self.shared is not None:
+            self.shared.set(f"thumbnail:{recipe_id}", [image_url, resolved_at],
+                            ttl=None if image_url else self.retry_missing)
+        with self.db.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO recipe_thumbnails (recipe_id, image_url, resolved_at) VALUES (?, ?, ?)',
+                (recipe_id, image_url, resolved_at)
+            )
+            conn.execute('DELETE FROM thumbnail_failures WHERE recipe_id = ?', (recipe_id,))
+            conn.commit()
+
+    def record_failure(self, recipe_id):
+        """Remember that Bing couldn't be asked, so the prefetch tries the recipe again later."""
+        with self.db.connection() as conn:
+            conn.execute('''
+                INSERT INTO thumbnail_failures (recipe_id, failures, failed_at) VALUES (?, 1, ?)
+                ON CONFLICT (recipe_id) DO UPDATE SET failures = failures + 1, failed_at = excluded.failed_at
+            ''', (recipe_id, time.time()))
+            conn.commit()
+
+    def search(self, recipe_id, title):
+        """Ask Bing and store the answer, once for concurrent misses with a SharedCache. Raises on upstream errors."""
+        def search_and_store():
+            image_url = get_first_image_url(title)
+            self.store(recipe_id, image_url)
+            return image_url
+
+        if self.shared is None:
+            return search_and_store()
+        return self.shared.coalesce(f"thumbnail:{recipe_id}", search_and_store)
+
+    def resolve(self, recipe_id, title):
+        found, image_url = self.lookup(recipe_id)
+        metrics.tag('hit' if found else 'miss')
+        if found:
+            return image_url
+        try:
+            return self.search(recipe_id, title)
+        except Exception as e:
+            # Upstream trouble is not a "no image" answer, only remember to try again
+            print(f"Error fetching thumbnail for recipe {recipe_id}: {str(e)}")
+            self.record_failure(recipe_id)
+            return None
+
+    async def resolve_async(self, recipe_id, title, search):
+        """
+        resolve() for the async server, `search(title)` is a coroutine function returning
+        the URL. The SQLite reads and writes run in the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        found, image_url = await loop.run_in_executor(None, self.lookup, recipe_id)
+        metrics.tag('hit' if found else 'miss')
+        if found:
+            return image_url
+
+        async def search_and_store():
+            image_url = await search(title)
+            await loop.run_in_executor(None, self.store, recipe_id, image_url)
+            return image_url
+
+        try:
+            if self.shared is None:
+                return await search_and_store()
+            return await self.shared.coalesce_async(f"thumbnail:{recipe_id}", search_and_store)
+        except Exception as e:
+            print(f"Error fetching thumbnail for recipe {recipe_id}: {str(e)}")
+            await loop.run_in_executor(None, self.record_failure, recipe_id)
+            return None
+
+    def unresolved(self, recipes_path, limit=None):
+        """
+        (recipe_id, title) of recipes without a stored thumbnail, with a "no image"
+        answer older than retry_missing, or whose last failure's backoff is over.
+        """
+        now = time.time()
+        with self.db.connection() as conn:
+            done = {row[0] for row in conn.execute(
+                'SELECT recipe_id FROM recipe_thumbnails WHERE image_url IS NOT NULL OR resolved_at > ?',
+                (now - self.retry_missing,)
+            )}
+            for recipe_id, failures, failed_at in conn.execute(
+                    'SELECT recipe_id, failures, failed_at FROM thumbnail_failures'):
+                if now - failed_at < min(self.retry_missing, self.retry_failed * 2 ** (failures - 1)):
+                    done.add(recipe_id)
+        conn = sqlite3.connect(f'file:{recipes_path}?mode=ro', uri=True)
+        pending = [(recipe_id, title) for recipe_id, title in conn.execute('SELECT id, Title FROM recipes ORDER BY id')
+                   if recipe_id not in done]
+        conn.close()
+        return pending[:limit] if limit else pending
+
+    def prefetch(self, recipes_path, delay=1.0, limit=None):
+        """Resolve every recipe that has no thumbnail yet, `delay` seconds apart to go easy on Bing."""
+        resolved = 0
+        for recipe_id, title in self.unresolved(recipes_path, limit):
+            if title:
+                self.resolve(recipe_id, title)
+                resolved += 1
+                time.sleep(delay)
+        return resolved
+
+    def start_prefetch(self, recipes_path, delay=1.0, lock_path=None):
+        """
+        Prefetch in a daemon thread, then again every retry_failed seconds for the recipes
+        due a retry. With lock_path only the process holding that file's lock prefetches,
+        the others wait for it and take over if that process exits.
+        """
+        def run():
+            if lock_path is not None:
+                # Kept open for the life of the process, the lock goes with it
+                lock_file = open(lock_path, 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            while True:
+                try:
+                    resolved = self.prefetch(recipes_path, delay)
+                    if resolved:
+                        print(f"Thumbnail prefetch finished, {resolved} recipes resolved")
+                except Exception as e:
+                    print(f"Thumbnail prefetch failed: {str(e)}")
+                time.sleep(self.retry_failed)
+
+        thread = threading.Thread(target=run, name='thumbnail-prefetch', daemon=True)
+        thread.start()
+        return thread
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Resolve thumbnails for every recipe ahead of time")
+    parser.add_argument('--recipes', default='backend/recipes.db')
+    parser.add_argument('--db', default='backend/thumbnails.db')
+    parser.add_argument('--delay', type=float, default=1.0, help="seconds between Bing requests")
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+
+    store = ThumbnailStore(args.db)
+    store.init_db()
+    print(f"Resolved {store.prefetch(args.recipes, args.delay, args.limit)} thumbnails")